@@ -0,0 +1,141 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import shared_cache
+
+TIMEOUT = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 60 * 5)
+LOCAL_TTL = getattr(settings, 'TOKEN_CACHE_LOCAL_TTL', 5)
+LOCAL_SIZE = getattr(settings, 'TOKEN_CACHE_SIZE', 1024)
+
+
+class LocalLRU:
+    """Небольшой LRU-кеш процесса с временем жизни записей."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+local_tokens = LocalLRU(LOCAL_SIZE, LOCAL_TTL)
+
+
+def token_cache_key(key):
+    return f'api:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def invalidate_token(key):
+    cache_key = token_cache_key(key)
+    local_tokens.delete(cache_key)
+    if shared_cache():
+        cache.delete(cache_key)
+
+
+class LazyUser(SimpleLazyObject):
+    """Пользователь, который читается из базы при первом обращении к полям.
+
+    pk, is_active, is_staff и признаки аутентификации известны из кеша
+    токена, поэтому проверка прав и фильтры по user_id обходятся без
+    запроса, а остальные поля, включая счётчики, всегда свежие.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, pk, is_active, is_staff):
+        super().__init__(
+            lambda: get_user_model()._default_manager.get(pk=pk))
+        self.__dict__['_cached_pk'] = pk
+        self.__dict__['_cached_is_active'] = is_active
+        self.__dict__['_cached_is_staff'] = is_staff
+
+    @property
+    def pk(self):
+        return self.__dict__['_cached_pk']
+
+    id = pk
+
+    @property
+    def is_active(self):
+        return self.__dict__['_cached_is_active']
+
+    @property
+    def is_staff(self):
+        return self.__dict__['_cached_is_staff']
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который не ходит в базу на каждый запрос.
+
+    В LRU процесса и, при общем кеше (Redis, Memcached), в кеше Django
+    лежат только id пользователя и флаги is_active и is_staff, сам
+    пользователь загружается лениво. При выходе, смене пароля, блокировке
+    пользователя и удалении токена запись удаляется из общего кеша и из
+    LRU текущего процесса; LRU других процессов живёт не дольше
+    TOKEN_CACHE_LOCAL_TTL секунд. С кешем в памяти процесса (LocMemCache)
+    удаление не дошло бы до других воркеров, поэтому тогда кеш Django
+    не используется.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        data = local_tokens.get(cache_key)
+        if data is None:
+            shared = shared_cache()
+            if shared:
+                data = cache.get(cache_key)
+            if data is None:
+                model = self.get_model()
+                try:
+                    data = model.objects.values_list(
+                        'user_id', 'user__is_active', 'user__is_staff'
+                    ).get(key=key)
+                except model.DoesNotExist:
+                    raise exceptions.AuthenticationFailed(
+                        _('Invalid token.'))
+                if shared:
+                    cache.set(cache_key, data, TIMEOUT)
+            local_tokens.set(cache_key, data)
+        user_id, is_active, is_staff = data
+        if not is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (LazyUser(user_id, is_active, is_staff),
+                self.get_model()(key=key, user_id=user_id))
@@ -0,0 +1,129 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+GENERATION_KEY = 'api:generation'
+POPULARITY_KEY = 'api:generation:popular'
+STATS_KEYS = {'hits': 'api:stats:hits', 'misses': 'api:stats:misses'}
+TIMEOUT = getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 60 * 5)
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+LOCK_POLL = 0.05
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache():
+    """Видят ли все процессы один кеш.
+
+    LocMemCache у каждого воркера свой: смена поколения или удаление
+    ключа в одном процессе не видны остальным.
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def get_generation(key=GENERATION_KEY):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, 1, timeout=None)
+        generation = cache.get(key, 1)
+    return generation
+
+
+def bump_generation(key=GENERATION_KEY, **kwargs):
+    """Сбрасывает все закешированные ответы сменой поколения."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 2, timeout=None)
+
+
+def bump_popularity(**kwargs):
+    """Сбрасывает только ответы, отсортированные по популярности."""
+    bump_generation(POPULARITY_KEY)
+
+
+def _count(name):
+    try:
+        cache.incr(STATS_KEYS[name])
+    except ValueError:
+        if not cache.add(STATS_KEYS[name], 1, timeout=None):
+            cache.incr(STATS_KEYS[name])
+
+
+def get_stats():
+    stats = cache.get_many(STATS_KEYS.values())
+    result = {
+        name: stats.get(key, 0) for name, key in STATS_KEYS.items()
+    }
+    result['generation'] = get_generation()
+    return result
+
+
+def make_key(request):
+    params = sorted(
+        (key, tuple(sorted(value for value in values if value)))
+        for key, values in request.query_params.lists()
+    )
+    params = [(key, values) for key, values in params if values]
+    raw = f'{request.get_host()}|{request.path}|{params}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    generation = get_generation()
+    if request.query_params.get('ordering') == 'popular':
+        generation = f'{generation}.{get_generation(POPULARITY_KEY)}'
+    return f'api:response:{generation}:{digest}'
+
+
+def cached_response(request, build):
+    """Отдаёт ответ анонимному GET-запросу из кеша.
+
+    При промахе ответ строит только один процесс, остальные ждут его
+    результат, чтобы истёкший популярный ключ не обрушил все запросы
+    в базу одновременно. Без общего кеша ответы не кешируются: другие
+    воркеры не узнали бы о смене поколения.
+    """
+    if (request.method != 'GET' or request.user.is_authenticated
+            or not shared_cache()):
+        return build()
+    key = make_key(request)
+    lock = f'{key}:lock'
+    data = cache.get(key)
+    locked = data is None and cache.add(lock, 1, LOCK_TIMEOUT)
+    if data is None and not locked:
+        deadline = time.monotonic() + LOCK_WAIT
+        while data is None and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            data = cache.get(key)
+    if data is not None:
+        _count('hits')
+        return Response(data)
+    _count('misses')
+    try:
+        response = build()
+        if response.status_code == 200:
+            cache.set(key, response.data, TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock)
+    return response
+
+
+class CachedResponseMixin:
+    """Кеширует list и retrieve для анонимных пользователей."""
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs)
+        )
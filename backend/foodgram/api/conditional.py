@@ -0,0 +1,52 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    raw = '|'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def table_version(queryset):
+    """Последнее изменение и число строк таблицы одним запросом."""
+    return queryset.order_by().aggregate(
+        last_modified=Max('updated'), count=Count('pk')
+    )
+
+
+def conditional_response(request, etag, last_modified, build):
+    """Отвечает 304 на совпавший If-None-Match, не строя ответ.
+
+    Last-Modified отдаётся только для справки: удаление строки или смена
+    флагов пользователя не сдвигают дату, поэтому If-Modified-Since без
+    ETag не проверяется.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class ConditionalListMixin:
+    """ETag для списка по версии всей таблицы и параметрам запроса."""
+
+    def list(self, request, *args, **kwargs):
+        version = table_version(self.queryset.model.objects.all())
+        etag = make_etag(
+            self.queryset.model._meta.label, version['last_modified'],
+            version['count'], request.get_full_path(),
+            request.accepted_media_type,
+        )
+        return conditional_response(
+            request, etag, version['last_modified'],
+            lambda: super(ConditionalListMixin, self).list(
+                request, *args, **kwargs)
+        )
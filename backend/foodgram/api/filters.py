@@ -1,6 +1,7 @@
 from django_filters import rest_framework as filters
 
 from recipes.models import Recipe, Tag, Ingredient
+from .search import get_search_backend
 
 
 class RecipeFilter(filters.FilterSet):
@@ -12,15 +13,28 @@ class RecipeFilter(filters.FilterSet):
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_list')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'по популярности'),),
+        method='filter_ordering'
+    )
+
+    def filter_search(self, queryset, name, value):
+        return get_search_backend().search(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-id')
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(favorites__user_id=self.request.user.pk)
         return queryset
 
     def filter_is_in_shopping_list(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_list__user=self.request.user)
+            return queryset.filter(shopping_list__user_id=self.request.user.pk)
         return queryset
 
     class Meta:
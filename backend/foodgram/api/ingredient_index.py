@@ -0,0 +1,130 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import islice
+
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from recipes.models import Ingredient
+
+VERSION_KEY = 'api:ingredient_index:version'
+CONTAINS_LIMIT = 20
+
+
+def fold(value):
+    """Приводит строку к виду для сравнения без учёта регистра и ё."""
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Отсортированный индекс ингредиентов в памяти процесса.
+
+    Поиск по началу названия идёт бинарным поиском, после совпадений
+    по началу строки выдаются не больше CONTAINS_LIMIT совпадений по
+    подстроке. Пока индекс не
+    построен или устарел, search() возвращает None и вызывающий код
+    обращается к базе; внутри bypass() так происходит всегда.
+    """
+
+    def __init__(self):
+        self._data = ([], [])
+        self._version = None
+        self._lock = threading.Lock()
+        self._warming = False
+        self._warming_lock = threading.Lock()
+        self._bypassed = False
+
+    @staticmethod
+    def current_version():
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+
+    def build(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            version = self.current_version()
+            rows = sorted(
+                (fold(name), pk, name, unit)
+                for pk, name, unit in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit').iterator()
+            )
+            items = [
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in rows
+            ]
+            self._data = ([row[0] for row in rows], items)
+            self._version = version
+        finally:
+            self._lock.release()
+
+    def warm(self):
+        """Строит индекс в фоне; одновременно работает только одна сборка."""
+        with self._warming_lock:
+            if self._warming:
+                return
+            self._warming = True
+        threading.Thread(target=self._warm, daemon=True).start()
+
+    def _warm(self):
+        try:
+            self.build()
+        finally:
+            self._warming = False
+
+    def invalidate(self, **kwargs):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 2, timeout=None)
+
+    @contextmanager
+    def bypass(self):
+        """Временно отправляет поиск в базу, не собирая индекс."""
+        bypassed, self._bypassed = self._bypassed, True
+        try:
+            yield
+        finally:
+            self._bypassed = bypassed
+
+    def is_ready(self):
+        return (self._version is not None
+                and self._version == self.current_version())
+
+    def search(self, query):
+        if self._bypassed:
+            return None
+        if not self.is_ready():
+            self.warm()
+            return None
+        keys, items = self._data
+        prefix = fold(query)
+        if not prefix:
+            return []
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + chr(0x10FFFF), start)
+        contains = islice((
+            items[position] for position, key in enumerate(keys)
+            if prefix in key and not start <= position < end
+        ), CONTAINS_LIMIT)
+        return items[start:end] + list(contains)
+
+
+ingredient_index = IngredientIndex()
+
+
+class IngredientSearchMixin:
+    """Отвечает на поиск по названию из индекса, минуя базу."""
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name', '')
+        # Пустой name, как и раньше, отдаёт весь список без ограничения.
+        if name.strip():
+            ingredients = ingredient_index.search(name)
+            if ingredients is not None:
+                return Response(ingredients)
+        return super().list(request, *args, **kwargs)
@@ -0,0 +1,61 @@
+from recipes.models import Favorite, ShoppingList
+from users.models import Follow
+
+RELATIONS = {
+    'is_subscribed': (Follow, 'author_id'),
+    'is_favorited': (Favorite, 'recipe_id'),
+    'is_in_shopping_cart': (ShoppingList, 'recipe_id'),
+}
+
+
+class RelationLoader:
+    """Собирает id объектов ответа и проверяет связи пользователя с ними.
+
+    Сериализаторы заранее сообщают нужные id через want(), а первый
+    вызов get() по связи загружает их все одним запросом с IN.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.pending = {relation: set() for relation in RELATIONS}
+        self.loaded = {relation: set() for relation in RELATIONS}
+        self.found = {relation: set() for relation in RELATIONS}
+
+    def want(self, relation, ids):
+        self.pending[relation].update(ids)
+
+    def set(self, relation, pk, value):
+        """Запоминает уже известное значение связи, например из аннотации."""
+        self.loaded[relation].add(pk)
+        self.pending[relation].discard(pk)
+        if value:
+            self.found[relation].add(pk)
+        else:
+            self.found[relation].discard(pk)
+
+    def get(self, relation, pk):
+        if self.user.is_anonymous:
+            return False
+        if pk not in self.loaded[relation]:
+            self.pending[relation].add(pk)
+            self.load(relation)
+        return pk in self.found[relation]
+
+    def load(self, relation):
+        model, field = RELATIONS[relation]
+        ids = self.pending[relation] - self.loaded[relation]
+        self.found[relation].update(
+            model.objects.filter(
+                user_id=self.user.pk, **{f'{field}__in': ids}
+            ).values_list(field, flat=True)
+        )
+        self.loaded[relation].update(ids)
+        self.pending[relation].clear()
+
+
+def get_loader(context):
+    loader = context.get('relation_loader')
+    if loader is None:
+        loader = RelationLoader(context['request'].user)
+        context['relation_loader'] = loader
+    return loader
@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from rest_framework.decorators import (api_view, permission_classes,
+                                       renderer_classes)
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .shopping_cart import PlainTextRenderer
+
+PREFIX = 'foodgram'
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HISTOGRAMS = {
+    'request_duration_seconds': ('Время ответа', SECONDS),
+    'db_duration_seconds': ('Время запросов к базе', SECONDS),
+    'serialization_duration_seconds': (
+        'Время сериализации и рендера ответа', SECONDS),
+    'db_queries': ('Число запросов к базе', (1, 2, 5, 10, 20, 50, 100, 200)),
+}
+FLUSH_INTERVAL = getattr(settings, 'API_METRICS_FLUSH_INTERVAL', 10)
+WORKER_TIMEOUT = 60 * 60
+WORKERS_KEY = 'api:metrics:workers'
+MAX_WORKERS = 64
+
+
+def worker_key(slot):
+    return f'api:metrics:worker:{slot}'
+
+
+class Registry:
+    """Гистограммы по эндпоинтам в памяти процесса.
+
+    Раз в API_METRICS_FLUSH_INTERVAL секунд снимок уходит в кеш под ключом
+    воркера, чтобы /api/metrics/ мог сложить данные всех воркеров. Номер
+    воркера выдаёт атомарный cache.incr. Складываются данные только тех
+    процессов, что видят один кеш: с LocMemCache (по умолчанию) метрики
+    у каждого процесса свои, для общей картины нужен Redis или Memcached
+    в CACHE_BACKEND.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = defaultdict(int)
+        self.flushed = 0.0
+        self.key = None
+        self.pid = None
+
+    def observe(self, endpoint, method, status, values):
+        with self.lock:
+            self.requests[(endpoint, method, status)] += 1
+            for name, value in values.items():
+                series = self.histograms.get((name, endpoint))
+                if series is None:
+                    series = [0] * (len(HISTOGRAMS[name][1]) + 2)
+                    self.histograms[(name, endpoint)] = series
+                series[bisect_left(HISTOGRAMS[name][1], value)] += 1
+                series[-1] += value
+        if time.monotonic() - self.flushed > FLUSH_INTERVAL:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': {
+                    key: list(series)
+                    for key, series in self.histograms.items()
+                },
+                'requests': dict(self.requests),
+            }
+
+    def register(self):
+        """Получает номер воркера; после fork() номер берётся заново."""
+        if self.key is None or self.pid != os.getpid():
+            try:
+                slot = cache.incr(WORKERS_KEY)
+            except ValueError:
+                slot = 1 if cache.add(WORKERS_KEY, 1, None) else cache.incr(
+                    WORKERS_KEY)
+            self.key = worker_key(slot)
+            self.pid = os.getpid()
+        return self.key
+
+    def flush(self):
+        self.flushed = time.monotonic()
+        cache.set(self.register(), self.snapshot(), WORKER_TIMEOUT)
+
+
+registry = Registry()
+
+
+def collect():
+    """Складывает снимки всех воркеров, включая текущий."""
+    registry.flush()
+    histograms = {}
+    requests = defaultdict(int)
+    last = cache.get(WORKERS_KEY) or 0
+    snapshots = cache.get_many([
+        worker_key(slot)
+        for slot in range(max(1, last - MAX_WORKERS + 1), last + 1)
+    ]).values()
+    for snapshot in snapshots:
+        for key, series in snapshot['histograms'].items():
+            total = histograms.setdefault(key, [0] * len(series))
+            for index, value in enumerate(series):
+                total[index] += value
+        for key, count in snapshot['requests'].items():
+            requests[key] += count
+    return histograms, requests
+
+
+def render_prometheus(histograms, requests):
+    lines = [
+        f'# HELP {PREFIX}_requests_total Число запросов',
+        f'# TYPE {PREFIX}_requests_total counter',
+    ]
+    for (endpoint, method, status), count in sorted(requests.items()):
+        lines.append(
+            f'{PREFIX}_requests_total{{endpoint="{endpoint}",'
+            f'method="{method}",status="{status}"}} {count}'
+        )
+    for name, (description, buckets) in HISTOGRAMS.items():
+        metric = f'{PREFIX}_{name}'
+        lines += [
+            f'# HELP {metric} {description}',
+            f'# TYPE {metric} histogram',
+        ]
+        for (series_name, endpoint), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            label = f'endpoint="{endpoint}"'
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), series):
+                cumulative += count
+                lines.append(
+                    f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{metric}_sum{{{label}}} {series[-1]:.6f}')
+            lines.append(f'{metric}_count{{{label}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusRenderer(PlainTextRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if renderer_context and renderer_context['response'].exception:
+            return super().render(data, accepted_media_type, renderer_context)
+        return data.encode(self.charset)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@renderer_classes([PrometheusRenderer])
+def metrics(request):
+    return Response(render_prometheus(*collect()))
+
+
+def request_metrics(request):
+    """Счётчики текущего запроса или None вне MetricsMiddleware."""
+    return getattr(request, '_metrics', None) if request is not None else None
+
+
+class TimedSerializerMixin:
+    """Добавляет построение serializer.data ко времени сериализации.
+
+    Учитывается только внешний сериализатор ответа: вложенные вызовы
+    to_representation входят в его время.
+    """
+
+    def to_representation(self, instance):
+        stats = request_metrics(self.context.get('request'))
+        if stats is None or stats['serializing']:
+            return super().to_representation(instance)
+        stats['serializing'] = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats['serializing'] = False
+            stats['serialize'] += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Считает запросы к базе и время ответа по каждому эндпоинту.
+
+    Сотрудникам время отдаётся в заголовке Server-Timing. У потоковых
+    ответов запросы и время досчитываются, пока клиент читает тело, и
+    попадают в гистограммы после его отдачи; в заголовок, отправленный
+    раньше тела, входит только то, что было до начала потока.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        stats = request._metrics = {
+            'queries': 0, 'db': 0.0, 'render': 0.0, 'serialize': 0.0,
+            'serializing': False, 'endpoint': 'unmatched',
+        }
+
+        def measure(execute, sql, params, many, context):
+            query_started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats['queries'] += 1
+                stats['db'] += time.perf_counter() - query_started
+
+        with connection.execute_wrapper(measure):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, measure,
+                lambda: self.observe(request, response, started),
+            )
+        else:
+            self.observe(request, response, started)
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or getattr(user, 'is_staff', False):
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={stats["db"] * 1000:.1f};'
+                f'desc="{stats["queries"]} queries"',
+                f'serialize;dur={stats["serialize"] * 1000:.1f}',
+                f'render;dur={stats["render"] * 1000:.1f}',
+                f'total;dur={(time.perf_counter() - started) * 1000:.1f}',
+            ))
+        return response
+
+    @staticmethod
+    def stream(content, measure, observe):
+        try:
+            with connection.execute_wrapper(measure):
+                yield from content
+        finally:
+            observe()
+
+    @staticmethod
+    def observe(request, response, started):
+        stats = request._metrics
+        registry.observe(
+            stats['endpoint'], request.method, response.status_code, {
+                'request_duration_seconds': time.perf_counter() - started,
+                'db_duration_seconds': stats['db'],
+                'serialization_duration_seconds': (
+                    stats['serialize'] + stats['render']),
+                'db_queries': stats['queries'],
+            }
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', view_func)
+        name = getattr(view_class, '__name__', 'unknown')
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            name += '.' + actions.get(request.method.lower(), 'unknown')
+        request._metrics['endpoint'] = name
+
+    def process_template_response(self, request, response):
+        stats = request._metrics
+        started = time.perf_counter()
+
+        def rendered(response):
+            stats['render'] += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
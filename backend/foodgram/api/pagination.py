@@ -0,0 +1,150 @@
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (CursorPagination, Cursor,
+                                       PageNumberPagination,
+                                       _reverse_ordering)
+from rest_framework.response import Response
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса без полного COUNT(*)."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(CursorPagination):
+    """Курсор по всему ключу сортировки, а не только по первому полю.
+
+    CursorPagination из DRF хранит в курсоре лишь ordering[0] и при
+    совпадениях листает смещением, которое упирается в offset_cutoff.
+    Здесь позиция — значения всех полей сортировки, последний из которых
+    pk, поэтому она уникальна и смещение не нужно.
+    """
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        if 'search_rank' in ordering or '-search_rank' in ordering:
+            raise ValidationError({'pagination': [
+                'Курсор недоступен при сортировке по релевантности поиска.'
+            ]})
+        if not {'pk', '-pk', 'id', '-id'} & set(ordering):
+            ordering.append('-pk')
+        self.ordering = tuple(ordering)
+        self.base_url = request.build_absolute_uri()
+        self.count = None
+        if request.query_params.get('count') == 'estimate':
+            self.count = estimate_count(queryset)
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        current_position = None if cursor is None else cursor.position
+        self.cursor = Cursor(
+            offset=0, reverse=reverse, position=current_position)
+        if reverse:
+            ordering = _reverse_ordering(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = queryset.filter(
+                self.after(ordering, current_position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering)
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None
+            self.next_position = following_position
+            self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after(self, ordering, position):
+        """Условие «строка идёт после позиции» для составного ключа.
+
+        Для ('-favorites_count', '-id') это
+        favorites_count < v OR (favorites_count = v AND id < pk).
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps(
+            [getattr(instance, field.lstrip('-')) for field in ordering],
+            cls=DjangoJSONEncoder,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class FeedPagination(PageNumberPagination):
+    """Постраничная выдача с переключением на курсор.
+
+    По умолчанию работает как обычная нумерация страниц. Запрос с
+    ``?pagination=cursor`` (или с уже полученным ``cursor``) листается
+    по ключу сортировки без OFFSET и без подсчёта всех строк;
+    ``?count=estimate`` добавляет в ответ оценку количества. С поиском
+    курсор не сочетается: релевантность не годится в ключ сортировки.
+    """
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (request.query_params.get('pagination') == 'cursor'
+                or 'cursor' in request.query_params):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
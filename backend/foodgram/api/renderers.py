@@ -0,0 +1,64 @@
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENABLED = orjson is not None and getattr(settings, 'API_FAST_JSON', False)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson, включается настройкой API_FAST_JSON.
+
+    Даты и прочие типы, которые DRF форматирует по-своему, отдаются
+    в JSONEncoder DRF. Без orjson и для ответов с отступами работает
+    штатный рендерер. Вывод совпадает с DRF не во всём: NaN и бесконечности
+    orjson пишет как null (DRF со STRICT_JSON выдаёт ошибку), а малые числа
+    с плавающей точкой записывает без ведущего нуля в порядке (1e-7
+    вместо 1e-07).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not ENABLED or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            option=(
+                orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_PASSTHROUGH_DATACLASS
+                | orjson.OPT_NON_STR_KEYS
+            ),
+        )
+        return ret.replace(
+            b'\xe2\x80\xa8', b'\\u2028'
+        ).replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser на orjson; без orjson работает штатный парсер."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if not ENABLED:
+            return super().parse(stream, media_type, parser_context)
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if codecs.lookup(encoding).name != 'utf-8':
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,228 @@
+import heapq
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import DEFERRED, Case, F, FloatField, Value, When
+from django.utils.module_loading import import_string
+
+from recipes.models import Recipe
+
+WORD_RE = re.compile(r'\w+')
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ией', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ов', 'ев',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ия', 'ть',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True)
+MIN_STEM = 3
+MAX_CANDIDATES = 500
+VERSION_KEY = 'api:search_index:version'
+SOURCE_FIELDS = ('name', 'text')
+
+
+def stem(word):
+    """Грубо отрезает окончание русского слова."""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(value):
+    return [
+        stem(word) for word in
+        WORD_RE.findall(value.casefold().replace('ё', 'е'))
+    ]
+
+
+class PostgresSearchBackend:
+    """Поиск по tsvector с GIN-индексом и русской морфологией."""
+    config = 'russian'
+
+    def search(self, queryset, value):
+        query = SearchQuery(value, config=self.config)
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-id')
+
+    def vector(self):
+        return (
+            SearchVector('name', weight='A', config=self.config)
+            + SearchVector('text', weight='B', config=self.config)
+        )
+
+    def update(self, recipe):
+        Recipe.objects.filter(pk=recipe.pk).update(
+            search_vector=self.vector())
+
+    def rebuild(self):
+        Recipe.objects.update(search_vector=self.vector())
+
+    def remove(self, pk):
+        pass
+
+
+class InMemorySearchBackend:
+    """Инвертированный индекс в памяти процесса для SQLite и тестов.
+
+    Каждый процесс держит свою копию индекса. Изменения рецептов сдвигают
+    общую версию в кеше, и остальные процессы перестраивают индекс при
+    следующем поиске; для этого кеш должен быть общим (не LocMem), иначе
+    процессы видят только свои изменения. Ранжируются не больше
+    MAX_CANDIDATES лучших совпадений.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.version = None
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def current_version():
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+
+    @property
+    def ready(self):
+        return (self.version is not None
+                and self.version == self.current_version())
+
+    def changed(self):
+        """Сдвигает общую версию после изменения в этом процессе."""
+        current = self.current_version()
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, current + 1, timeout=None)
+            version = current + 1
+        # Если кто-то успел изменить индекс раньше, своя копия устарела.
+        self.version = version if self.version == current else None
+
+    def build(self):
+        with self.lock:
+            version = self.current_version()
+            self.postings.clear()
+            self.documents.clear()
+            for pk, name, text in Recipe.objects.values_list(
+                    'pk', 'name', 'text').iterator():
+                self.add(pk, name, text)
+            self.version = version
+
+    def add(self, pk, name, text):
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(text):
+            weights[token] += TEXT_WEIGHT
+        for token, weight in weights.items():
+            self.postings[token][pk] = weight
+        self.documents[pk] = tuple(weights)
+
+    def discard(self, pk):
+        for token in self.documents.pop(pk, ()):
+            self.postings[token].pop(pk, None)
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def remove(self, pk):
+        with self.lock:
+            self.discard(pk)
+            self.changed()
+
+    def rebuild(self):
+        self.build()
+        self.changed()
+
+    def update(self, recipe):
+        with self.lock:
+            self.discard(recipe.pk)
+            self.add(recipe.pk, recipe.name, recipe.text)
+            self.changed()
+
+    def rank(self, value):
+        if not self.ready:
+            self.build()
+        tokens = tokenize(value)
+        if not tokens:
+            return {}
+        with self.lock:
+            postings = [self.postings.get(token, {}) for token in tokens]
+        scores = dict.fromkeys(min(postings, key=len), 0.0)
+        for posting in postings:
+            scores = {
+                pk: score + posting[pk] for pk, score in scores.items()
+                if pk in posting
+            }
+        if len(scores) > MAX_CANDIDATES:
+            scores = dict(heapq.nlargest(
+                MAX_CANDIDATES, scores.items(),
+                key=lambda item: (item[1], item[0]),
+            ))
+        return scores
+
+    def search(self, queryset, value):
+        scores = self.rank(value)
+        if not scores:
+            return queryset.none()
+        return queryset.filter(pk__in=scores).annotate(
+            search_rank=Case(
+                *(When(pk=pk, then=Value(score))
+                  for pk, score in scores.items()),
+                output_field=FloatField(),
+            )
+        ).order_by('-search_rank', '-id')
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'RECIPE_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = InMemorySearchBackend()
+    return _backend
+
+
+def search_source(instance):
+    return tuple(
+        instance.__dict__.get(field, DEFERRED) for field in SOURCE_FIELDS
+    )
+
+
+def remember_search_source(sender, instance, **kwargs):
+    instance._search_source = search_source(instance)
+
+
+def update_search_index(sender, instance, created=False, update_fields=None,
+                        **kwargs):
+    """Обновляет индекс, только если изменились название или описание."""
+    if update_fields is not None and not set(SOURCE_FIELDS) & set(
+            update_fields):
+        return
+    source = search_source(instance)
+    if not created and getattr(instance, '_search_source', None) == source:
+        return
+    get_search_backend().update(instance)
+    instance._search_source = source
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
@@ -1,5 +1,8 @@
+from collections import defaultdict
+
 import webcolors
 from django.db import transaction
+from django.db.models import Manager, OuterRef, Subquery
 from django.contrib.auth.password_validation import validate_password
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
@@ -7,8 +10,15 @@ from rest_framework import serializers
 from rest_framework.validators import ValidationError
 
 from recipes.models import (Favorite, Ingredient, IngredientsRecipe, Recipe,
-                            ShoppingList, Tag)
-from users.models import Follow, User
+                            ShoppingCartItem, ShoppingList, Tag)
+from recipes.renditions import rendition_urls
+from users.models import User
+from .loaders import get_loader
+from .metrics import TimedSerializerMixin
+from .uploads import RecipeImageField
+
+RECIPES_LIMIT = 3
+MAX_RECIPES_LIMIT = 20
 
 
 class Hex2NameColor(serializers.Field):
@@ -23,6 +33,45 @@ class Hex2NameColor(serializers.Field):
         return data
 
 
+def sparse_fields(request, available):
+    """Поля ответа по параметрам ?fields= и ?omit=; id остаётся всегда."""
+    available = set(available)
+    fields = request.query_params.get('fields')
+    omit = request.query_params.get('omit')
+    if fields is None and omit is None:
+        return available
+    keep = set(filter(None, (fields or '').split(','))) or set(available)
+    drop = set(filter(None, (omit or '').split(',')))
+    unknown = (keep | drop) - available
+    if unknown:
+        raise ValidationError(
+            {'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'}
+        )
+    return (keep - drop) | {'id'}
+
+
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля, запрошенные через ?fields=/?omit=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None:
+            keep = sparse_fields(request, self.fields)
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+class RelationListSerializer(serializers.ListSerializer):
+    """Заранее сообщает загрузчику связей id всех объектов списка."""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        if self.context.get('request') is not None:
+            self.child.want_relations(get_loader(self.context), items)
+        return super().to_representation(items)
+
+
 class UserCreateSerializer(UserCreateSerializer):
 
     class Meta:
@@ -36,7 +85,7 @@ class UserCreateSerializer(UserCreateSerializer):
         )
 
 
-class UserSerializer(UserSerializer):
+class UserSerializer(TimedSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -49,12 +98,16 @@ class UserSerializer(UserSerializer):
             'last_name',
             'is_subscribed',
         )
+        list_serializer_class = RelationListSerializer
+
+    @staticmethod
+    def want_relations(loader, users):
+        loader.want('is_subscribed', (user.pk for user in users))
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=user, author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return get_loader(self.context).get('is_subscribed', obj.pk)
 
 
 class PasswordSerializer(serializers.Serializer):
@@ -73,7 +126,7 @@ class PasswordSerializer(serializers.Serializer):
             )
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     color = Hex2NameColor()
 
     class Meta:
@@ -81,7 +134,8 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
@@ -100,13 +154,79 @@ class IngredientsRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'amount',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class IngredientAmountListSerializer(serializers.ListSerializer):
+    """Проверяет все ингредиенты рецепта одним запросом с IN."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ids = [item['id'] for item in items]
+        if len(set(ids)) != len(ids):
+            raise ValidationError('Ингридиент уже добавлен в рецепт')
+        ingredients = Ingredient.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in ingredients]
+        if missing:
+            raise ValidationError(
+                f'Ингредиенты не найдены: {", ".join(missing)}'
+            )
+        return [
+            {'ingredient': ingredients[item['id']], 'amount': item['amount']}
+            for item in items
+        ]
+
+
+class IngredientAmountSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = IngredientsRecipe
+        fields = ('id', 'amount',)
+        list_serializer_class = IngredientAmountListSerializer
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список id, который проверяется одним запросом, а не по одному."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        queryset = child.get_queryset()
+        # Как у IngredientAmountSerializer.id: 1.9 или True не становятся 1.
+        integer = serializers.IntegerField()
+        pks = []
+        for pk in data:
+            try:
+                pks.append(integer.to_internal_value(pk))
+            except serializers.ValidationError:
+                child.fail('incorrect_type', data_type=type(pk).__name__)
+        objects = queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in dict.fromkeys(pks)]
+
+
+def set_prefetched(instance, name, objects):
+    """Кладёт уже загруженные объекты в кеш prefetch_related экземпляра."""
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
+
+class RecipeSerializer(TimedSerializerMixin, SparseFieldsMixin,
+                       serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     tags = TagSerializer(many=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     image = Base64ImageField()
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -119,35 +239,56 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "renditions",
             "text",
             "cooking_time",
         )
+        list_serializer_class = RelationListSerializer
+
+    @staticmethod
+    def want_relations(loader, recipes):
+        ids = [recipe.pk for recipe in recipes]
+        loader.want('is_favorited', ids)
+        loader.want('is_in_shopping_cart', ids)
+        loader.want('is_subscribed', (recipe.author_id for recipe in recipes))
+
+    def to_representation(self, recipe):
+        if (hasattr(recipe, 'author_is_subscribed')
+                and self.context.get('request') is not None):
+            get_loader(self.context).set(
+                'is_subscribed', recipe.author_id,
+                recipe.author_is_subscribed)
+        return super().to_representation(recipe)
+
+    def get_renditions(self, obj):
+        return rendition_urls(obj, self.context.get('request'))
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorites.filter(recipe=obj).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return get_loader(self.context).get('is_favorited', obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.shopping_list.filter(recipe=obj).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return get_loader(self.context).get('is_in_shopping_cart', obj.pk)
 
     @staticmethod
     def get_ingredients(obj):
-        ingredients = IngredientsRecipe.objects.filter(recipe=obj)
-        return IngredientsRecipeSerializer(ingredients, many=True).data
+        return IngredientsRecipeSerializer(
+            obj.recipe_ingredients.all(), many=True
+        ).data
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
-    ingredients = IngredientsRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
+class RecipeCreateSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
+    ingredients = IngredientAmountSerializer(many=True)
+    tags = BulkManyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Tag.objects.all()
+        )
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
     name = serializers.CharField(max_length=200)
     author = UserSerializer(read_only=True)
 
@@ -166,7 +307,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def create_ingredients(ingredients, recipe):
-        IngredientsRecipe.objects.bulk_create(
+        return IngredientsRecipe.objects.bulk_create(
             IngredientsRecipe(
                 recipe=recipe,
                 amount=ingredient['amount'],
@@ -176,17 +317,10 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
 
     def validate(self, data):
-        ingredients = data['ingredients']
-        ingredient_list = []
-        if not ingredients:
+        if data.get('ingredients') == []:
             raise serializers.ValidationError(
                 'в рецепте должен быть хоть один ингридиент'
             )
-        for ingredient in ingredients:
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингридиент уже добавлен в рецепт')
-            ingredient_list.append(ingredient)
         return data
 
     @transaction.atomic
@@ -195,31 +329,86 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients_data = validated_data.pop("ingredients")
         image = validated_data.pop("image")
         recipe = Recipe.objects.create(image=image, **validated_data)
-        self.create_ingredients(ingredients_data, recipe)
+        ingredients = self.create_ingredients(ingredients_data, recipe)
         recipe.tags.set(tags_data)
+        set_prefetched(recipe, 'tags', tags_data)
+        set_prefetched(recipe, 'recipe_ingredients', ingredients)
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
         return recipe
 
+    @staticmethod
+    def update_tags(recipe, tags):
+        current = {tag.pk: tag for tag in recipe.tags.all()}
+        wanted = {tag.pk: tag for tag in tags}
+        removed = [tag for pk, tag in current.items() if pk not in wanted]
+        added = [tag for pk, tag in wanted.items() if pk not in current]
+        if removed:
+            recipe.tags.remove(*removed)
+        if added:
+            recipe.tags.add(*added)
+        set_prefetched(recipe, 'tags', tags)
+
+    def update_ingredients(self, recipe, ingredients):
+        """Меняет только те строки состава, которые действительно изменились.
+
+        Возвращает id ингредиентов, суммы по которым нужно пересчитать.
+        """
+        current = {row.ingredient_id: row for row in
+                   recipe.recipe_ingredients.all()}
+        wanted = {item['ingredient'].pk: item for item in ingredients}
+        removed = [row for pk, row in current.items() if pk not in wanted]
+        changed = []
+        for pk, row in current.items():
+            if pk in wanted and row.amount != wanted[pk]['amount']:
+                row.amount = wanted[pk]['amount']
+                changed.append(row)
+        created = self.create_ingredients(
+            [item for pk, item in wanted.items() if pk not in current],
+            recipe,
+        )
+        if removed:
+            IngredientsRecipe.objects.filter(
+                pk__in=[row.pk for row in removed]).delete()
+        if changed:
+            IngredientsRecipe.objects.bulk_update(changed, ('amount',))
+        set_prefetched(recipe, 'recipe_ingredients', [
+            row for pk, row in current.items() if pk in wanted
+        ] + created)
+        return {row.ingredient_id for row in (*removed, *changed, *created)}
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        IngredientsRecipe.objects.filter(recipe=instance).delete()
-        instance.tags.set(tags)
-        self.create_ingredients(ingredients, instance)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if tags is not None:
+            self.update_tags(instance, tags)
+        if ingredients is not None:
+            ingredient_ids = self.update_ingredients(instance, ingredients)
+            cart_users = list(
+                instance.shopping_list.values_list('user_id', flat=True)
+            ) if ingredient_ids else []
+            if cart_users:
+                ShoppingCartItem.objects.refresh(cart_users, ingredient_ids)
         return super().update(instance, validated_data)
 
     def to_representation(self, recipe):
-        data = RecipeSerializer(
-            recipe, context={"request": self.context.get("request")}
-        ).data
-        return data
+        return RecipeSerializer(recipe, context=self.context).data
 
 
-class RecipeShortShowSerializer(serializers.ModelSerializer):
+class RecipeShortShowSerializer(TimedSerializerMixin,
+                                serializers.ModelSerializer):
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'author', 'name', 'image', 'cooking_time',)
+        fields = (
+            'id', 'author', 'name', 'image', 'renditions', 'cooking_time',
+        )
+
+    def get_renditions(self, obj):
+        return rendition_urls(obj, self.context.get('request'))
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -262,28 +451,82 @@ class ShoppingListSerializer(serializers.ModelSerializer):
         return RecipeShortShowSerializer(instance.recipe, context=context).data
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+def recipes_preview(author_ids, limit=RECIPES_LIMIT):
+    """Последние рецепты каждого автора одним запросом.
+
+    Ограничение на автора задаёт коррелированный подзапрос с LIMIT.
+    """
+    previews = defaultdict(list)
+    if not author_ids or limit == 0:
+        return previews
+    recipes = Recipe.objects.filter(
+        author_id__in=author_ids,
+        pk__in=Subquery(
+            Recipe.objects.filter(author_id=OuterRef('author_id'))
+            .order_by('-id').values('pk')[:limit]
+        ),
+    )
+    for recipe in recipes.order_by('author_id', '-id').only(
+            'id', 'author_id', 'name', 'image', 'renditions', 'cooking_time'):
+        previews[recipe.author_id].append(recipe)
+    return previews
+
+
+def get_recipes_limit(request):
+    """Сколько рецептов показать в карточке подписки.
+
+    Без параметра или с некорректным значением — RECIPES_LIMIT, большие
+    значения обрезаются до MAX_RECIPES_LIMIT.
+    """
+    limit = request.query_params.get('recipes_limit') if request else None
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return RECIPES_LIMIT
+    if limit < 0:
+        return RECIPES_LIMIT
+    return min(limit, MAX_RECIPES_LIMIT)
+
+
+class FollowListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        authors = list(data)
+        self.context['recipes_preview'] = recipes_preview(
+            [author.pk for author in authors],
+            get_recipes_limit(self.context.get('request')),
+        )
+        return super().to_representation(authors)
+
+
+class FollowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     recipes_count = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     is_subscribed = serializers.BooleanField(default=True)
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        recipes = Recipe.objects.filter(author=obj)
-        limit = request.query_params.get('recipes_limit')
-        if limit:
-            recipes = recipes[:int(limit)]
+        previews = self.context.get('recipes_preview')
+        if previews is None:
+            previews = recipes_preview([obj.pk], get_recipes_limit(request))
         return RecipeShortShowSerializer(
-            recipes[:3], many=True, context={'request': request}
+            previews.get(obj.pk, []), many=True, context={'request': request}
         ).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     class Meta:
         model = User
+        list_serializer_class = FollowListSerializer
         fields = (
             'id',
             'email',
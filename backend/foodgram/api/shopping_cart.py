@@ -0,0 +1,85 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from recipes.models import ShoppingCartItem
+
+CHUNK_SIZE = 2000
+
+
+class PlainTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(str(value) for value in data.values())
+        return str(data).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def shopping_cart_rows(user):
+    return (
+        ShoppingCartItem.objects.filter(user=user)
+        .order_by('ingredient__name')
+        .values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def render_txt(rows):
+    yield 'Список покупок:\n'
+    for name, measure, amount in rows:
+        yield f'{name.capitalize()} {amount} {measure},\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_json(rows):
+    separator = '['
+    for name, measure, amount in rows:
+        yield separator + json.dumps(
+            {'name': name, 'measurement_unit': measure, 'amount': amount},
+            ensure_ascii=False,
+        )
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+EXPORTERS = {
+    PlainTextRenderer.format: render_txt,
+    CSVRenderer.format: render_csv,
+    JSONRenderer.format: render_json,
+}
+RENDERER_CLASSES = (PlainTextRenderer, CSVRenderer, JSONRenderer)
+
+
+def shopping_cart_response(user, renderer):
+    """Отдаёт список покупок потоком, не собирая файл в памяти."""
+    response = StreamingHttpResponse(
+        EXPORTERS[renderer.format](shopping_cart_rows(user)),
+        content_type=f'{renderer.media_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping_list.{renderer.format}"'
+    )
+    return response
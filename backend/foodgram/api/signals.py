@@ -0,0 +1,131 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save)
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Favorite, Ingredient, IngredientsRecipe, Recipe, Tag
+from users.models import User, relations_changed
+from .authentication import invalidate_token
+from .cache import bump_generation, bump_popularity
+from .ingredient_index import ingredient_index
+from .search import (remember_search_source, remove_from_search_index,
+                     update_search_index)
+
+# Кеш отдаёт только анонимные ответы, поэтому поколение меняется лишь
+# при изменениях, видимых анониму. Избранное и список покупок на них не
+# влияют, кроме счётчика избранного: он сбрасывает только ответы с
+# сортировкой popular.
+CACHED_MODELS = (Recipe, IngredientsRecipe, Tag, Ingredient)
+# Поля автора, которые выводятся в рецептах.
+RESPONSE_FIELDS = ('username', 'email', 'first_name', 'last_name')
+# Поля, от которых зависит закешированная проверка токена.
+TOKEN_FIELDS = ('password', 'is_active', 'is_staff')
+
+
+def forget_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+def favorites_counted(sender, created=True, **kwargs):
+    if created:
+        bump_popularity()
+
+
+def user_fields(instance):
+    # Отложенные поля не читаются, чтобы не делать лишних запросов.
+    return {
+        field: instance.__dict__.get(field)
+        for field in RESPONSE_FIELDS + TOKEN_FIELDS
+    }
+
+
+def remember_user_fields(sender, instance, **kwargs):
+    instance._api_fields = user_fields(instance)
+
+
+def user_changed(sender, instance, created=False, update_fields=None,
+                 **kwargs):
+    """Сбрасывает кеш ответов и токены, только если это нужно.
+
+    Новый пользователь ещё не виден в ответах, а вход (last_login) и
+    прочие поля не попадают ни в ответы, ни в кеш токенов.
+    """
+    fields = user_fields(instance)
+    if update_fields is not None:
+        fields = {
+            field: value for field, value in fields.items()
+            if field in update_fields
+        }
+    previous = getattr(instance, '_api_fields', {})
+    instance._api_fields = {**previous, **fields}
+    if created:
+        return
+    changed = {
+        field for field, value in fields.items()
+        if previous.get(field) != value
+    }
+    if changed & set(RESPONSE_FIELDS):
+        bump_generation()
+    if changed & set(TOKEN_FIELDS):
+        for key in Token.objects.filter(user=instance).values_list(
+                'key', flat=True):
+            invalidate_token(key)
+
+
+def connect_signals():
+    for model in CACHED_MODELS:
+        post_save.connect(
+            bump_generation, sender=model,
+            dispatch_uid=f'api_cache_save_{model.__name__}'
+        )
+        post_delete.connect(
+            bump_generation, sender=model,
+            dispatch_uid=f'api_cache_delete_{model.__name__}'
+        )
+    post_save.connect(
+        ingredient_index.invalidate, sender=Ingredient,
+        dispatch_uid='ingredient_index_save'
+    )
+    post_delete.connect(
+        ingredient_index.invalidate, sender=Ingredient,
+        dispatch_uid='ingredient_index_delete'
+    )
+    post_init.connect(
+        remember_search_source, sender=Recipe,
+        dispatch_uid='recipe_search_source'
+    )
+    post_save.connect(
+        update_search_index, sender=Recipe,
+        dispatch_uid='recipe_search_save'
+    )
+    post_delete.connect(
+        remove_from_search_index, sender=Recipe,
+        dispatch_uid='recipe_search_delete'
+    )
+    post_save.connect(
+        favorites_counted, sender=Favorite,
+        dispatch_uid='api_cache_favorites_add'
+    )
+    post_delete.connect(
+        favorites_counted, sender=Favorite,
+        dispatch_uid='api_cache_favorites_del'
+    )
+    relations_changed.connect(
+        favorites_counted, sender=Favorite,
+        dispatch_uid='api_cache_favorites'
+    )
+    post_init.connect(
+        remember_user_fields, sender=User, dispatch_uid='api_user_fields'
+    )
+    post_save.connect(
+        user_changed, sender=User, dispatch_uid='api_user_save'
+    )
+    m2m_changed.connect(
+        bump_generation, sender=Recipe.tags.through,
+        dispatch_uid='api_cache_recipe_tags'
+    )
+    post_save.connect(
+        forget_token, sender=Token, dispatch_uid='api_token_save'
+    )
+    post_delete.connect(
+        forget_token, sender=Token, dispatch_uid='api_token_delete'
+    )
@@ -0,0 +1,843 @@
+import base64
+import io
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import local_tokens, token_cache_key
+from api.cache import get_generation, get_stats, make_key
+from api.filters import IngredientFilter
+from api.ingredient_index import CONTAINS_LIMIT, ingredient_index
+from api.metrics import Registry, collect, registry
+from api.pagination import KeysetPagination
+from api.search import MAX_CANDIDATES, InMemorySearchBackend
+from api.serializers import MAX_RECIPES_LIMIT, RECIPES_LIMIT
+from recipes.management.commands.seed_data import PREFIX
+from recipes.models import (Favorite, Ingredient, IngredientsRecipe, Recipe,
+                            ShoppingList, Tag)
+from users.models import Follow, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def image(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), (color, 20, 30)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeQueriesTest(TestCase):
+    """Число запросов не зависит от числа рецептов и ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.token = Token.objects.create(user=cls.user).key
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {index}', slug=f'tag-{index}',
+                color=f'#00000{index}')
+            for index in range(3)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(10)
+        )
+        cls.tags = list(Tag.objects.order_by('pk'))
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def request(self, method, url, data=None, queries=None):
+        """Запрос с холодными кешами ответов и токенов.
+
+        Возвращает число запросов к базе; если queries задано, проверяет,
+        что их ровно столько.
+        """
+        cache.clear()
+        local_tokens.clear()
+        with CaptureQueriesContext(connection) as captured:
+            if queries is None:
+                response = getattr(self.client, method)(
+                    url, data, format='json')
+            else:
+                with self.assertNumQueries(queries):
+                    response = getattr(self.client, method)(
+                        url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content)
+        return len(captured)
+
+    def make_recipes(self, count, ingredients=3):
+        start = Recipe.objects.count()
+        for index in range(start, start + count):
+            author = User.objects.create_user(
+                username=f'author{index}', email=f'author{index}@ex.com')
+            if index % 2:
+                Follow.objects.create(user=self.user, author=author)
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {index}', text='текст',
+                cooking_time=10, image='recipes/images/x.png',
+            )
+            recipe.tags.set(self.tags)
+            IngredientsRecipe.objects.bulk_create(
+                IngredientsRecipe(recipe=recipe, ingredient=ingredient,
+                                  amount=5)
+                for ingredient in self.ingredients[:ingredients]
+            )
+        return recipe
+
+    def recipe_data(self, ingredients):
+        return {
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 3}
+                for ingredient in ingredients
+            ],
+            'tags': [tag.pk for tag in self.tags],
+            'image': image(len(ingredients)),
+            'name': 'Новый',
+            'text': 'Текст',
+            'cooking_time': 5,
+        }
+
+    def test_list(self):
+        self.make_recipes(2)
+        queries = self.request('get', '/api/recipes/')
+        self.make_recipes(8)
+        self.request('get', '/api/recipes/', queries=queries)
+
+    def test_retrieve(self):
+        recipe = self.make_recipes(1, ingredients=1)
+        queries = self.request('get', f'/api/recipes/{recipe.pk}/')
+        recipe = self.make_recipes(1, ingredients=10)
+        self.request('get', f'/api/recipes/{recipe.pk}/', queries=queries)
+
+    def test_create(self):
+        queries = self.request(
+            'post', '/api/recipes/', self.recipe_data(self.ingredients[:2]))
+        self.request('post', '/api/recipes/',
+                     self.recipe_data(self.ingredients), queries=queries)
+
+    def test_update(self):
+        recipe = Recipe.objects.create(
+            author=self.user, name='Свой', text='текст', cooking_time=10,
+            image='recipes/images/x.png',
+        )
+        url = f'/api/recipes/{recipe.pk}/'
+        queries = self.request(
+            'patch', url, self.recipe_data(self.ingredients[:2]))
+        recipe.recipe_ingredients.all().delete()
+        recipe.tags.set(self.tags[:1])
+        self.request('patch', url, self.recipe_data(self.ingredients),
+                     queries=queries)
+
+    def test_update_removing_ingredients(self):
+        queries = []
+        for count, buyers in ((3, 1), (10, 3)):
+            recipe = Recipe.objects.create(
+                author=self.user, name='Свой', text='текст', cooking_time=10,
+                image='recipes/images/x.png',
+            )
+            IngredientsRecipe.objects.bulk_create(
+                IngredientsRecipe(recipe=recipe, ingredient=ingredient,
+                                  amount=5)
+                for ingredient in self.ingredients[:count]
+            )
+            for index in range(buyers):
+                buyer, _ = User.objects.get_or_create(
+                    username=f'buyer{index}',
+                    defaults={'email': f'buyer{index}@ex.com'})
+                ShoppingList.objects.add(buyer, [recipe.pk])
+            data = self.recipe_data(self.ingredients[:2])
+            data['image'] = image(count)
+            queries.append(self.request(
+                'patch', f'/api/recipes/{recipe.pk}/', data))
+            self.assertEqual(recipe.recipe_ingredients.count(), 2)
+        self.assertEqual(queries[0], queries[1])
+
+    def test_author_flag_does_not_touch_request_user(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(self.ingredients[:2]),
+            format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertFalse(response.data['author']['is_subscribed'])
+        self.assertFalse(
+            hasattr(response.wsgi_request.user, 'is_subscribed'))
+
+
+class KeysetPaginationTest(TestCase):
+    """Курсорная выдача не теряет и не повторяет рецепты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com')
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {index}', text='текст',
+                   cooking_time=10, image='recipes/images/x.png')
+            for index in range(7)
+        )
+
+    def pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            self.assertLessEqual(len(ids), Recipe.objects.count(), ids)
+            url = response.data['next']
+        return ids
+
+    def test_equal_sort_keys(self):
+        ids = self.pages(
+            '/api/recipes/?pagination=cursor&ordering=popular&limit=2')
+        self.assertEqual(
+            ids, list(Recipe.objects.order_by('-id').values_list(
+                'id', flat=True)))
+
+    def test_ties_beyond_offset_cutoff(self):
+        # Курсор DRF при совпадениях листает смещением до offset_cutoff;
+        # здесь оно меньше числа одинаковых ключей.
+        with mock.patch.object(KeysetPagination, 'offset_cutoff', 2):
+            ids = self.pages(
+                '/api/recipes/?pagination=cursor&ordering=popular&limit=1')
+        self.assertEqual(
+            ids, list(Recipe.objects.order_by('-id').values_list(
+                'id', flat=True)))
+
+    def test_previous_pages(self):
+        url = '/api/recipes/?pagination=cursor&ordering=popular&limit=2'
+        while True:
+            response = self.client.get(url)
+            if response.data['next'] is None:
+                break
+            url = response.data['next']
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            ids[:0] = [recipe['id'] for recipe in response.data['results']]
+            url = response.data['previous']
+        self.assertEqual(
+            ids, list(Recipe.objects.order_by('-id').values_list(
+                'id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=cD0x')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_search_is_rejected(self):
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&search=Рецепт')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pagination', response.data)
+
+
+class CacheGenerationTest(TestCase):
+    """Кеш анонимных ответов сбрасывают только видимые анониму изменения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='текст', cooking_time=10,
+            image='recipes/images/x.png',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def key(self, url):
+        return make_key(Request(APIRequestFactory().get(url)))
+
+    def test_favorites_reset_only_popular(self):
+        generation = get_generation()
+        popular = self.key('/api/recipes/?ordering=popular')
+        plain = self.key('/api/recipes/')
+        Favorite.objects.create(user=self.author, recipe=self.recipe)
+        ShoppingList.objects.create(user=self.author, recipe=self.recipe)
+        self.assertEqual(get_generation(), generation)
+        self.assertEqual(self.key('/api/recipes/'), plain)
+        self.assertNotEqual(
+            self.key('/api/recipes/?ordering=popular'), popular)
+
+    def test_author_edit_resets_cache(self):
+        generation = get_generation()
+        self.author.first_name = 'Новое имя'
+        self.author.save()
+        self.assertNotEqual(get_generation(), generation)
+        generation = get_generation()
+        self.author.save(update_fields=('last_login',))
+        self.assertEqual(get_generation(), generation)
+
+    def test_process_local_cache_is_bypassed(self):
+        self.client.get('/api/recipes/')
+        self.assertEqual(get_stats()['misses'], 0)
+        shared = 'django.core.cache.backends.filebased.FileBasedCache'
+        with tempfile.TemporaryDirectory() as location, override_settings(
+                CACHES={'default': {'BACKEND': shared,
+                                    'LOCATION': location}}):
+            self.client.get('/api/recipes/')
+            self.client.get('/api/recipes/')
+            self.assertEqual(get_stats()['hits'], 1)
+
+    def test_signup_and_hidden_fields_keep_cache(self):
+        generation = get_generation()
+        user = User.objects.create_user(
+            username='newcomer', email='newcomer@example.com')
+        user.set_password('secret')
+        user.save()
+        self.author.save()
+        self.assertEqual(get_generation(), generation)
+
+
+class IngredientIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('Соль', 'Морская соль', 'Сахар')
+        )
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.build()
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(
+            [item['name'] for item in ingredient_index.search('сол')],
+            ['Соль', 'Морская соль'])
+
+    def test_substring_matches_are_capped(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Перец {index}', measurement_unit='г')
+            for index in range(CONTAINS_LIMIT * 2)
+        )
+        ingredient_index.build()
+        self.assertEqual(
+            len(ingredient_index.search('ец')), CONTAINS_LIMIT)
+
+    def test_blank_name(self):
+        self.assertEqual(ingredient_index.search('  '), [])
+
+    def test_blank_query_lists_everything(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Перец {index}', measurement_unit='г')
+            for index in range(CONTAINS_LIMIT * 2)
+        )
+        for url in ('/api/ingredients/', '/api/ingredients/?name=',
+                    '/api/ingredients/?name=%20'):
+            response = self.client.get(url)
+            self.assertEqual(len(response.data), Ingredient.objects.count())
+
+    def test_single_warm_up(self):
+        ingredient_index.invalidate()
+        with mock.patch('threading.Thread') as thread:
+            for _ in range(3):
+                self.assertIsNone(ingredient_index.search('сол'))
+        thread.assert_called_once()
+        ingredient_index._warming = False
+
+    def test_bypass(self):
+        ingredient_index.invalidate()
+        with mock.patch('threading.Thread') as thread:
+            with ingredient_index.bypass():
+                self.assertIsNone(ingredient_index.search('сол'))
+        thread.assert_not_called()
+        ingredient_index.build()
+        with ingredient_index.bypass():
+            self.assertIsNone(ingredient_index.search('сол'))
+        self.assertEqual(len(ingredient_index.search('сол')), 2)
+
+
+class RecipeRetrieveTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag', color='#000000')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='текст', cooking_time=10,
+            image='recipes/images/x.png',
+        )
+        cls.recipe.tags.set([cls.tag])
+        cls.url = f'/api/recipes/{cls.recipe.pk}/'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_invalid_pk(self):
+        self.assertEqual(self.client.get('/api/recipes/abc/').status_code,
+                         404)
+
+    def test_etag_follows_related_objects(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code,
+            304)
+        self.tag.name = 'Другой тег'
+        self.tag.save()
+        changed = self.client.get(self.url)['ETag']
+        self.assertNotEqual(changed, etag)
+        self.author.first_name = 'Имя'
+        self.author.save()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], changed)
+
+    def test_last_modified_alone_is_ignored(self):
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+
+class SubscriptionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com')
+        for index in range(3):
+            author = User.objects.create_user(
+                username=f'author{index}', email=f'author{index}@ex.com')
+            Follow.objects.create(user=cls.user, author=author)
+            for number in range(index + 1):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {number}', text='текст',
+                    cooking_time=10, image='recipes/images/x.png',
+                )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=2')
+        self.assertEqual(response.status_code, 200, response.content)
+        for author in response.data['results']:
+            expected = list(Recipe.objects.filter(
+                author__username=author['username']
+            ).order_by('-id').values_list('id', flat=True)[:2])
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']], expected)
+
+    def test_zero_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=0')
+        self.assertEqual(response.status_code, 200, response.content)
+        for author in response.data['results']:
+            self.assertEqual(author['recipes'], [])
+
+    def test_default_and_maximum_limit(self):
+        author = User.objects.create_user(
+            username='prolific', email='prolific@ex.com')
+        Follow.objects.create(user=self.user, author=author)
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {number}', text='текст',
+                   cooking_time=10, image='recipes/images/x.png')
+            for number in range(MAX_RECIPES_LIMIT + 5)
+        )
+        for query, expected in (('', RECIPES_LIMIT),
+                                ('?recipes_limit=abc', RECIPES_LIMIT),
+                                ('?recipes_limit=-1', RECIPES_LIMIT),
+                                ('?recipes_limit=1000', MAX_RECIPES_LIMIT)):
+            response = self.client.get(f'/api/users/subscriptions/{query}')
+            self.assertEqual(response.status_code, 200, response.content)
+            recipes = {
+                item['username']: item['recipes']
+                for item in response.data['results']
+            }
+            self.assertEqual(len(recipes['prolific']), expected, query)
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com')
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, name, text='текст'):
+        return Recipe.objects.create(
+            author=self.author, name=name, text=text, cooking_time=10,
+            image='recipes/images/x.png',
+        )
+
+    def test_other_processes_see_changes(self):
+        first, second = InMemorySearchBackend(), InMemorySearchBackend()
+        first.build()
+        second.build()
+        recipe = self.create('Борщ')
+        second.update(recipe)
+        self.assertFalse(first.ready)
+        self.assertIn(recipe.pk, first.rank('борщ'))
+
+    def test_candidates_are_capped(self):
+        backend = InMemorySearchBackend()
+        backend.build()
+        for pk in range(MAX_CANDIDATES + 10):
+            backend.add(pk, 'Суп', '')
+        self.assertEqual(len(backend.rank('суп')), MAX_CANDIDATES)
+
+    def test_index_updates_only_on_source_change(self):
+        recipe = self.create('Суп')
+        with mock.patch('api.search.get_search_backend') as backend:
+            recipe.cooking_time = 20
+            recipe.save()
+            backend().update.assert_not_called()
+            recipe.text = 'Новый текст'
+            recipe.save()
+            backend().update.assert_called_once_with(recipe)
+
+
+class RelationBatchTest(TestCase):
+    """Пакетные связи возвращают только реально изменённые рецепты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {index}', text='текст',
+                cooking_time=10, image='recipes/images/x.png',
+            )
+            for index in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_batch_favorites(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        url = '/api/recipes/favorite/'
+        self.client.post(url, {'recipes': [first]}, format='json')
+        response = self.client.post(
+            url, {'recipes': [first, second, third]}, format='json')
+        self.assertEqual(response.data, {'added': [second, third]})
+        response = self.client.delete(
+            url, {'recipes': [second, 10 ** 6]}, format='json')
+        self.assertEqual(response.data, {'removed': [second]})
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('favorites_count', flat=True)),
+            [0, 1, 1])
+
+
+class RecipeIdsValidationTest(TestCase):
+    """Нецелые id тегов и ингредиентов отклоняются, а не округляются."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='cook', email='cook@example.com')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag', color='#000000')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, tags, ingredients):
+        return self.client.post('/api/recipes/', {
+            'tags': tags,
+            'ingredients': [{'id': pk, 'amount': 1} for pk in ingredients],
+            'image': image(1),
+            'name': 'Рецепт',
+            'text': 'текст',
+            'cooking_time': 5,
+        }, format='json')
+
+    def test_fractional_ids(self):
+        tag, ingredient = self.tag.pk, self.ingredient.pk
+        for tags, ingredients, field in (
+            ([tag + 0.9], [ingredient], 'tags'),
+            ([True], [ingredient], 'tags'),
+            ([tag], [ingredient + 0.9], 'ingredients'),
+        ):
+            with self.subTest(tags=tags, ingredients=ingredients):
+                response = self.post(tags, ingredients)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+
+class CachedTokenTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.token = Token.objects.create(user=cls.user).key
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_cache_holds_only_id_and_flags(self):
+        self.client.get('/api/users/me/')
+        self.assertEqual(local_tokens.get(token_cache_key(self.token)),
+                         (self.user.pk, True, False))
+        # LocMemCache у каждого воркера свой: удаление из него не дошло бы
+        # до других процессов.
+        self.assertIsNone(cache.get(token_cache_key(self.token)))
+
+    def test_shared_cache(self):
+        shared = 'django.core.cache.backends.filebased.FileBasedCache'
+        with tempfile.TemporaryDirectory() as location, override_settings(
+                CACHES={'default': {'BACKEND': shared,
+                                    'LOCATION': location}}):
+            self.client.get('/api/users/me/')
+            key = token_cache_key(self.token)
+            self.assertEqual(cache.get(key), (self.user.pk, True, False))
+            self.user.is_active = False
+            self.user.save()
+            self.assertIsNone(cache.get(key))
+
+    def test_list_does_not_load_user(self):
+        self.client.get('/api/recipes/')
+        # Только COUNT пустой выдачи: ни токен, ни пользователь не читаются.
+        with self.assertNumQueries(1):
+            self.client.get('/api/recipes/')
+
+    def test_user_is_loaded_fresh(self):
+        self.client.get('/api/users/me/')
+        User.objects.filter(pk=self.user.pk).update(first_name='Новое')
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['first_name'], 'Новое')
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(
+            self.client.get('/api/users/me/').status_code, 401)
+
+    def test_profile_edit_keeps_tokens(self):
+        self.client.get('/api/users/me/')
+        self.user.first_name = 'Новое'
+        # Только UPDATE: токены пользователя не перечитываются.
+        with self.assertNumQueries(1):
+            self.user.save()
+        self.assertIsNotNone(local_tokens.get(token_cache_key(self.token)))
+
+    def test_password_change(self):
+        self.client.get('/api/users/me/')
+        self.user.set_password('new-pass')
+        self.user.save(update_fields=('password',))
+        self.assertIsNone(local_tokens.get(token_cache_key(self.token)))
+        self.assertIsNone(cache.get(token_cache_key(self.token)))
+
+    def test_logout(self):
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            self.client.get('/api/users/me/').status_code, 401)
+
+
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com')
+        Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='текст', cooking_time=10,
+            image='recipes/images/x.png',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_serializer_time_is_counted(self):
+        response = self.client.get('/api/recipes/')
+        self.assertGreater(response.wsgi_request._metrics['serialize'], 0)
+
+    def test_streaming_queries_are_counted(self):
+        with mock.patch.object(registry, 'observe') as observe:
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/')
+            before = response.wsgi_request._metrics['queries']
+            observe.assert_not_called()
+            b''.join(response.streaming_content)
+        self.assertGreater(response.wsgi_request._metrics['queries'], before)
+        observe.assert_called_once()
+
+    def test_workers_get_separate_slots(self):
+        first, second = Registry(), Registry()
+        first.observe('Endpoint', 'GET', 200, {'db_queries': 1})
+        second.observe('Endpoint', 'GET', 200, {'db_queries': 1})
+        first.flush()
+        second.flush()
+        self.assertNotEqual(first.key, second.key)
+        with mock.patch('api.metrics.registry', Registry()):
+            requests = collect()[1]
+        self.assertEqual(requests[('Endpoint', 'GET', 200)], 2)
+
+
+class LookupIndexTest(TestCase):
+    """Запросы API на заполненной базе читают индексы, а не всю таблицу.
+
+    Планы снимаются с SQL, который действительно выполняют представления
+    и команды, после ANALYZE на данных seed_data.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_data', users=60, recipes=600, ingredients=1500, tags=4,
+            ingredients_per_recipe=6, follows_per_user=8,
+            favorites_per_user=15, cart_per_user=4, stdout=io.StringIO(),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.filter(
+            username__startswith=PREFIX, shopping_list__isnull=False,
+            favorites__isnull=False, follower__isnull=False,
+        ).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def explain(sql):
+        prefix = (
+            'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+            else 'EXPLAIN '
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            return '\n'.join(
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+
+    def plan(self, run):
+        """Планы всех SELECT, выполненных в run()."""
+        with CaptureQueriesContext(connection) as captured:
+            run()
+        return '\n'.join(
+            self.explain(query['sql']) for query in captured
+            if query['sql'].startswith('SELECT')
+        )
+
+    def get(self, url):
+        def run():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+        return self.plan(run)
+
+    def assertIndexScan(self, plan, model, *indexes, search=True):
+        """Проверяет, что план читает хотя бы один из индексов indexes.
+
+        SQLite называет индексы уникальных ограничений сам, поэтому для
+        них ищется индекс таблицы sqlite_autoindex_*. С search=True на
+        SQLite нужен поиск по ключу (SEARCH), а не проход всего индекса.
+        """
+        constraints = {
+            constraint.name for constraint in model._meta.constraints}
+        names = [
+            f'sqlite_autoindex_{model._meta.db_table}_'
+            if connection.vendor == 'sqlite' and index in constraints
+            else index
+            for index in indexes
+        ]
+        access = (
+            'SEARCH' if search and connection.vendor == 'sqlite' else 'INDEX')
+        self.assertTrue(
+            any(name in line and access in line.upper()
+                for line in plan.splitlines() for name in names),
+            f'{", ".join(indexes)} не используется:\n{plan}',
+        )
+
+    @staticmethod
+    def fk_index(model, field):
+        """Имя, которое Django дал индексу внешнего ключа."""
+        column = model._meta.get_field(field).column
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table)
+        return next(
+            name for name, constraint in constraints.items()
+            if constraint['index'] and constraint['columns'] == [column]
+        )
+
+    def test_recipe_flags(self):
+        plan = self.get('/api/recipes/')
+        self.assertIndexScan(
+            plan, Favorite, 'favorite_unique', 'favorite_recipe_user_idx')
+        self.assertIndexScan(
+            plan, ShoppingList, 'shopping_list_user_recipe_idx',
+            'unique_recipe_list')
+        self.assertIndexScan(
+            plan, Follow, 'unique_follow', 'follow_author_user_idx')
+
+    def test_recipe_filters(self):
+        self.assertIndexScan(
+            self.get('/api/recipes/?is_favorited=1'), Favorite,
+            'favorite_unique')
+        self.assertIndexScan(
+            self.get('/api/recipes/?is_in_shopping_cart=1'), ShoppingList,
+            'shopping_list_user_recipe_idx')
+
+    def test_popularity(self):
+        self.assertIndexScan(
+            self.get('/api/recipes/?ordering=popular&pagination=cursor'),
+            Recipe, 'recipe_popularity_idx', search=False)
+
+    def test_subscriptions(self):
+        plan = self.get('/api/users/subscriptions/')
+        self.assertIndexScan(plan, Follow, 'unique_follow')
+        self.assertIndexScan(plan, Recipe, self.fk_index(Recipe, 'author'))
+
+    def test_recount(self):
+        plan = self.plan(lambda: call_command('recount', stdout=io.StringIO()))
+        self.assertIndexScan(plan, Favorite, 'favorite_recipe_user_idx')
+        self.assertIndexScan(plan, Follow, 'follow_author_user_idx')
+
+    def test_cart_totals(self):
+        plan = self.plan(lambda: call_command(
+            'rebuild_shopping_cart', '--check', stdout=io.StringIO()))
+        self.assertIndexScan(
+            plan, ShoppingList, 'shopping_list_user_recipe_idx')
+        self.assertIndexScan(
+            plan, IngredientsRecipe, 'unique_recipe_ingredient')
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'функциональный индекс создаётся только на Postgres')
+    def test_ingredient_prefix(self):
+        name = Ingredient.objects.order_by('pk').last().name
+        queryset = IngredientFilter(
+            {'name': name.lower()}, queryset=Ingredient.objects.all()).qs
+        self.assertIndexScan(
+            self.explain(str(queryset.query)), Ingredient,
+            'ingredient_name_prefix_idx')
@@ -0,0 +1,90 @@
+import json
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.exceptions import ParseError
+from rest_framework.fields import ImageField
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+MAX_SIZE = getattr(settings, 'RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024)
+MAX_SIDE = getattr(settings, 'RECIPE_IMAGE_MAX_SIDE', 8000)
+
+
+def check_image_size(size):
+    if size > MAX_SIZE:
+        raise ValidationError(
+            'Размер изображения не должен превышать '
+            f'{filesizeformat(MAX_SIZE)}'
+        )
+
+
+class CheckedImageField(forms.ImageField):
+    """Проверяет размер файла и заголовок изображения до его разбора."""
+
+    def to_python(self, data):
+        if data in self.empty_values:
+            return None
+        check_image_size(data.size)
+        try:
+            width, height = Image.open(data).size
+        except Exception:
+            raise ValidationError(self.error_messages['invalid_image'])
+        finally:
+            data.seek(0)
+        if max(width, height) > MAX_SIDE:
+            raise ValidationError(
+                f'Стороны изображения не должны превышать {MAX_SIDE} px'
+            )
+        return super().to_python(data)
+
+
+class RecipeImageField(Base64ImageField):
+    """Принимает изображение строкой base64 или файлом multipart/form-data."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('_DjangoImageField', CheckedImageField)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return ImageField.to_internal_value(self, data)
+        if isinstance(data, str):
+            encoded = data.partition(';base64,')[2] or data
+            check_image_size(len(encoded) * 3 // 4)
+        return super().to_internal_value(data)
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """multipart/form-data, где вложенные поля можно передать строкой JSON.
+
+    Поля перечисляются в атрибуте view json_form_fields. Например,
+    ingredients='[{"id": 1, "amount": 10}]' раскладывается в поля формы
+    ingredients[0]id и ingredients[0]amount, которые понимает DRF, а
+    tags='[1, 2]' - в повторяющееся поле tags.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = super().parse(stream, media_type, parser_context)
+        view = (parser_context or {}).get('view')
+        data = result.data.copy()
+        for key in getattr(view, 'json_form_fields', ()):
+            if key not in data:
+                continue
+            try:
+                values = [json.loads(value) for value in data.pop(key)]
+            except ValueError as error:
+                raise ParseError(f'Поле {key}: некорректный JSON - {error}')
+            if len(values) == 1 and isinstance(values[0], list):
+                values = values[0]
+            for index, value in enumerate(values):
+                if not isinstance(value, dict):
+                    data.appendlist(key, value)
+                    continue
+                for name, item in value.items():
+                    data[f'{key}[{index}]{name}'] = item
+        return DataAndFiles(data, result.files)
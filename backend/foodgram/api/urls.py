@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .metrics import metrics
 from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                    TagViewSet)
+                    TagViewSet, cache_stats)
 
 app_name = 'api'
 
@@ -14,6 +15,8 @@ router.register('tags', TagViewSet)
 router.register('recipes', RecipeViewSet)
 
 urlpatterns = [
+    path('cache/stats/', cache_stats, name='cache_stats'),
+    path('metrics/', metrics, name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
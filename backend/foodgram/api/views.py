@@ -1,21 +1,30 @@
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, Max, OuterRef, Subquery,
+                              Value)
 from rest_framework import status, viewsets
-from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
 from djoser.views import UserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 
 from users.models import Follow, User
+from .cache import CachedResponseMixin, get_stats
+from .conditional import (ConditionalListMixin, conditional_response,
+                          make_etag)
+from .ingredient_index import IngredientSearchMixin
 from .permissions import IsOwnerOrReadOnly
-from recipes.models import (Ingredient, IngredientsRecipe, Recipe,
-                            ShoppingList, Tag, Favorite)
+from recipes.models import (Ingredient, Recipe, ShoppingList, Tag,
+                            Favorite)
+from .shopping_cart import RENDERER_CLASSES, shopping_cart_response
+from .renderers import FastJSONParser
+from .uploads import MultiPartJSONParser
 from .serializers import (FollowSerializer,
                           IngredientSerializer, PasswordSerializer,
-                          RecipeCreateSerializer, RecipeSerializer,
-                          TagSerializer,
+                          RecipeCreateSerializer, RecipeIdsSerializer,
+                          RecipeSerializer, TagSerializer, sparse_fields,
                           UserCreateSerializer, UserSerializer,
                           RecipeShortShowSerializer)
 from .filters import RecipeFilter, IngredientFilter
@@ -83,34 +92,33 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated],
         url_path='subscribe',
     )
+    @transaction.atomic
     def subscribe(self, request, id):
         user = request.user
         author = get_object_or_404(User, id=id)
-        subscription = Follow.objects.filter(
-            user=user,
-            author=author
-        )
-
         if request.method == 'POST':
-            if subscription.exists():
-                return Response({'error': 'Ты уже подписан на пользователя'},
-                                status=status.HTTP_400_BAD_REQUEST)
             if user == author:
                 return Response({'error': 'Нельзя подписаться на самого себя'},
                                 status=status.HTTP_400_BAD_REQUEST)
+            created = Follow.objects.add(user, [author.pk])
             serializer = FollowSerializer(author, context={'request': request})
-            Follow.objects.create(user=user, author=author)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(
+                serializer.data,
+                status=(status.HTTP_201_CREATED if created
+                        else status.HTTP_200_OK)
+            )
+        Follow.objects.remove(user, [author.pk])
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        if request.method == 'DELETE':
-            if subscription.exists():
-                subscription.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response({'error': 'У вас нет подписки'},
-                            status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    return Response(get_stats())
 
-class IngredientViewSet(viewsets.ModelViewSet):
+
+class IngredientViewSet(ConditionalListMixin, IngredientSearchMixin,
+                        CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
@@ -119,23 +127,124 @@ class IngredientViewSet(viewsets.ModelViewSet):
     pagination_class = None
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalListMixin, CachedResponseMixin,
+                 viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def latest(model):
+    """Последнее изменение связанных с рецептом тегов или ингредиентов."""
+    return Subquery(
+        model.objects.filter(recipes=OuterRef('pk')).order_by()
+        .values('recipes').annotate(latest=Max('updated')).values('latest')
+    )
+
+
+FLAGS = {
+    'is_favorited': 'is_favorited',
+    'is_in_shopping_cart': 'is_in_shopping_cart',
+    'author_is_subscribed': 'author',
+}
+DEFERRABLE = {
+    'text': {'text'},
+    'image': {'image', 'renditions'},
+    'renditions': {'renditions'},
+}
+
+
+class RecipeViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsOwnerOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    parser_classes = (FastJSONParser, MultiPartJSONParser)
+    json_form_fields = ('ingredients', 'tags')
+
+    def get_queryset(self):
+        queryset = Recipe.objects.defer('search_vector')
+        if self.action not in ('list', 'retrieve'):
+            return self.annotate_flags(
+                queryset.select_related('author').prefetch_related(
+                    'tags', 'recipe_ingredients__ingredient'
+                )
+            )
+        fields = sparse_fields(self.request, RecipeSerializer.Meta.fields)
+        if 'author' in fields:
+            queryset = queryset.select_related('author')
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related('tags')
+        if 'ingredients' in fields:
+            queryset = queryset.prefetch_related(
+                'recipe_ingredients__ingredient')
+        deferred = [
+            column for column, needed_by in DEFERRABLE.items()
+            if not fields & needed_by
+        ]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return self.annotate_flags(queryset, fields)
+
+    def annotate_flags(self, queryset, fields=None):
+        user = self.request.user
+        flags = {
+            'is_favorited': Favorite.objects.filter(
+                user_id=user.pk, recipe=OuterRef('pk')),
+            'is_in_shopping_cart': ShoppingList.objects.filter(
+                user_id=user.pk, recipe=OuterRef('pk')),
+            'author_is_subscribed': Follow.objects.filter(
+                user_id=user.pk, author=OuterRef('author')),
+        } if user.is_authenticated else dict.fromkeys(FLAGS)
+        return queryset.annotate(**{
+            flag: Exists(subquery) if subquery is not None
+            else Value(False, output_field=BooleanField())
+            for flag, subquery in flags.items()
+            if fields is None or FLAGS[flag] in fields
+        })
+
+    def retrieve(self, request, *args, **kwargs):
+        # Правка тега, ингредиента или профиля автора не меняет
+        # Recipe.updated, поэтому их версии тоже входят в ETag.
+        state = get_object_or_404(
+            self.annotate_flags(Recipe.objects.annotate(
+                tags_updated=latest(Tag),
+                ingredients_updated=latest(Ingredient),
+            )).values(
+                'updated', 'tags_updated', 'ingredients_updated',
+                'author__username', 'author__email', 'author__first_name',
+                'author__last_name', 'is_favorited', 'is_in_shopping_cart',
+                'author_is_subscribed',
+            ),
+            pk=kwargs['pk'],
+        )
+        etag = make_etag(
+            Recipe._meta.label, kwargs['pk'], *state.values(),
+            request.accepted_media_type, request.query_params.get('fields'),
+            request.query_params.get('omit'),
+        )
+        return conditional_response(
+            request, etag, None,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs)
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def update(self, request, *args, **kwargs):
+        # В отличие от UpdateModelMixin кеш prefetch не сбрасывается:
+        # сериализатор сам держит теги и состав в нём актуальными, и ответ
+        # строится из него без повторных запросов.
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(
+            self.get_object(), data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
+
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return RecipeSerializer
@@ -163,51 +272,58 @@ class RecipeViewSet(viewsets.ModelViewSet):
         else:
             return self.delete_from(ShoppingList, request.user, pk)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def favorite_batch(self, request):
+        return self.change_batch(Favorite, request)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_batch(self, request):
+        return self.change_batch(ShoppingList, request)
+
+    @transaction.atomic
     def add_to(self, model, user, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
-            return Response({'errors': 'Рецепт уже добавлен!'},
-                            status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
+        recipe = get_object_or_404(Recipe.objects.defer('search_vector'),
+                                   id=pk)
+        created = model.objects.add(user, [recipe.pk])
         serializer = RecipeShortShowSerializer(recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
 
+    @transaction.atomic
     def delete_from(self, model, user, pk):
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Рецепт уже удален!'},
-                        status=status.HTTP_400_BAD_REQUEST)
-
-    def create_shopping_cart(self, ingredients):
-        shopping_list = 'список покупок:'
-        for ingredient in ingredients:
-            shopping_list += (
-                f"\n{ingredient['ingredient__name']} "
-                f"({ingredient['ingredient__measurement_unit']}) - "
-                f"{ingredient['ingredient_value']}")
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
-        return response
+        if not model.objects.remove(user, [pk]):
+            get_object_or_404(Recipe, id=pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @transaction.atomic
+    def change_batch(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            return Response({'added': model.objects.add(request.user, ids)})
+        return Response({'removed': model.objects.remove(request.user, ids)})
 
     @action(
         detail=False,
         methods=['GET'],
         url_path='download_shopping_cart',
+        permission_classes=[IsAuthenticated],
+        renderer_classes=RENDERER_CLASSES,
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = (
-            IngredientsRecipe.objects.filter(recipe__shopping_list__user=user)
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(amount=Sum("amount"))
-        )
-        data = ingredients.values_list(
-            "ingredient__name", "ingredient__measurement_unit", "amount"
-        )
-        shopping_cart = "Список покупок:\n"
-        for name, measure, amount in data:
-            shopping_cart += f"{name.capitalize()} {amount} {measure},\n"
-        return HttpResponse(shopping_cart, content_type="text/plain")
+        return shopping_cart_response(request.user, request.accepted_renderer)
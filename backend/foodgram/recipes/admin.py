@@ -2,7 +2,7 @@ from django.contrib import admin
 from import_export import resources
 from import_export.admin import ImportExportActionModelAdmin
 
-from .models import (Favorite, Ingredient, Recipe,
+from .models import (Favorite, Ingredient, Recipe, ShoppingCartItem,
                      ShoppingList, Tag, IngredientsRecipe)
 
 
@@ -31,12 +31,36 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags')
     inlines = (IngredientsInline,)
 
+    @admin.display(description='В избранном', ordering='favorites_count')
     def count_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Состав меняется построчно в инлайне, суммы пересчитываются разом.
+        ShoppingCartItem.objects.refresh_recipes([form.instance.pk])
+
+
+class ShoppingListAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        user_ids = {obj.user_id, form.initial.get('user')} - {None}
+        ShoppingCartItem.objects.refresh(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingCartItem.objects.refresh([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingCartItem.objects.refresh(user_ids)
 
 
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Favorite)
-admin.site.register(ShoppingList)
+admin.site.register(ShoppingList, ShoppingListAdmin)
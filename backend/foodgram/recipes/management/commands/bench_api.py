@@ -0,0 +1,428 @@
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Max, Min
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Favorite, Ingredient, Recipe, Tag
+from users.models import Follow, User
+
+from .seed_data import PREFIX
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+QUERIES_SLACK = 0.5
+RECIPE_SAMPLE = 1000
+TOGGLE_PAIRS = 100
+# Меняют данные (счётчики, корзины, поколения кеша), поэтому идут
+# после всех читающих сценариев.
+WRITE_SCENARIOS = ('recipes.favorite.toggle',)
+
+
+def percentile(values, rank):
+    """Процентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * rank // 100) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class InProcessTransport:
+    """Запросы через django.test.Client в потоках текущего процесса.
+
+    SQLite не переносит параллельной записи, поэтому на ней изменяющие
+    запросы идут по одному.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.writes = (
+            threading.Lock() if connection.vendor == 'sqlite' else None
+        )
+        self.host = next(
+            (host for host in settings.ALLOWED_HOSTS if '*' not in host),
+            'localhost',
+        )
+
+    def __call__(self, method, path, token, data=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST=self.host)
+        extra = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        if data is not None:
+            extra['data'] = json.dumps(data)
+            extra['content_type'] = 'application/json'
+        started = time.perf_counter()
+        if self.writes is not None and method != 'GET':
+            with self.writes:
+                response = self.send(client, method, path, extra)
+        else:
+            response = self.send(client, method, path, extra)
+        elapsed = time.perf_counter() - started
+        metrics = getattr(response.wsgi_request, '_metrics', None)
+        return (
+            response.status_code,
+            elapsed,
+            metrics['queries'] if metrics else None,
+        )
+
+    @staticmethod
+    def send(client, method, path, extra):
+        """Выполняет запрос и дочитывает потоковое тело, как это сделал бы
+        клиент: запросы и время генерации файла входят в замер."""
+        response = getattr(client, method.lower())(path, **extra)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+
+class HTTPTransport:
+    """Запросы к уже запущенному серверу; число запросов к базе берётся
+    из Server-Timing (нужен DEBUG или токен сотрудника)."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def __call__(self, method, path, token, data=None):
+        request = Request(
+            self.url + path,
+            method=method,
+            data=json.dumps(data).encode() if data is not None else None,
+            headers={'Content-Type': 'application/json'},
+        )
+        if token:
+            request.add_header('Authorization', f'Token {token}')
+        started = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except HTTPError as error:
+            error.read()
+            status, headers = error.code, error.headers
+        elapsed = time.perf_counter() - started
+        match = QUERIES.search(headers.get('Server-Timing', ''))
+        return status, elapsed, int(match.group(1)) if match else None
+
+
+class Command(BaseCommand):
+    help = ('Нагружает эндпоинты API параллельными клиентами и выводит '
+            'p50/p95/p99, пропускную способность и число запросов к базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Сколько запросов отправить на каждый сценарий',
+        )
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Сколько запросов сценария не учитывать',
+        )
+        parser.add_argument(
+            '--users', type=int, default=20,
+            help='Сколько пользователей из seed_data будут клиентами',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--only', nargs='+', metavar='SCENARIO',
+            help='Запустить только указанные сценарии',
+        )
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера; без него запросы идут '
+                 'в текущем процессе',
+        )
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument(
+            '--compare', metavar='BASELINE',
+            help='Сравнить с ранее сохранённым результатом',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=20.0,
+            help='Допустимый рост p95 при сравнении, в процентах',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tokens = self.tokens(options['users'])
+        scenarios = self.scenarios(rng, tokens)
+        if options['only']:
+            unknown = set(options['only']) - set(scenarios)
+            if unknown:
+                raise CommandError(
+                    f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+            scenarios = {
+                name: scenarios[name] for name in options['only']
+            }
+        scenarios = dict(sorted(
+            scenarios.items(), key=lambda item: item[0] in WRITE_SCENARIOS))
+        transport = (
+            HTTPTransport(options['url']) if options['url']
+            else InProcessTransport()
+        )
+        results = {}
+        try:
+            for name, requests in scenarios.items():
+                results[name] = self.run(
+                    transport, requests, options['requests'],
+                    options['concurrency'], options['warmup'],
+                )
+                self.report(name, results[name])
+        finally:
+            self.restore()
+        report = {'meta': self.meta(options), 'results': results}
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    @staticmethod
+    def tokens(count):
+        users = list(
+            User.objects.filter(username__startswith=PREFIX)
+            .order_by('pk')[:count]
+        )
+        if not users:
+            raise CommandError('Нет данных: сначала запустите seed_data')
+        return {
+            user.pk: Token.objects.get_or_create(user=user)[0].key
+            for user in users
+        }
+
+    def scenarios(self, rng, tokens):
+        """Сценарий — список шагов (метод, путь, токен, тело) для цикла.
+
+        Шаг может быть и кортежем шагов: их выполняет один клиент подряд.
+        """
+        user_ids = list(tokens)
+        recipe_ids = self.sample_recipes(rng)
+        tags = list(Tag.objects.values_list('slug', flat=True))
+        names = list(
+            Ingredient.objects.values_list('name', flat=True)[:500])
+        words = [
+            word for name in Recipe.objects.values_list(
+                'name', flat=True)[:500]
+            for word in name.split() if len(word) > 3
+        ]
+        authors = list(
+            Follow.objects.filter(user_id__in=user_ids)
+            .values_list('author_id', flat=True)[:200]
+        ) or user_ids
+
+        def user():
+            return tokens[rng.choice(user_ids)]
+
+        def repeat(build, count=200):
+            return [build() for _ in range(count)]
+
+        # У каждой пары (пользователь, рецепт) своя запись: POST и DELETE
+        # идут подряд в одном клиенте, а пар больше, чем клиентов, так что
+        # параллельные клиенты не трогают одну и ту же пару и после
+        # сценария избранное возвращается к исходному.
+        self.toggled = self.free_pairs(rng, user_ids, recipe_ids)
+        toggle = [
+            (('POST', f'/api/recipes/{recipe}/favorite/', tokens[user_id],
+              None),
+             ('DELETE', f'/api/recipes/{recipe}/favorite/', tokens[user_id],
+              None))
+            for user_id, recipe in self.toggled
+        ]
+        return {
+            'recipes.list': repeat(lambda: (
+                'GET', f'/api/recipes/?page={rng.randint(1, 5)}', None, None,
+            )),
+            'recipes.list.auth': repeat(lambda: (
+                'GET', f'/api/recipes/?page={rng.randint(1, 5)}', user(),
+                None,
+            )),
+            'recipes.cards': repeat(lambda: (
+                'GET', '/api/recipes/?fields=id,name,image,cooking_time',
+                None, None,
+            )),
+            'recipes.tags': repeat(lambda: (
+                'GET', f'/api/recipes/?tags={rng.choice(tags)}', None, None,
+            )),
+            'recipes.popular': repeat(lambda: (
+                'GET', '/api/recipes/?ordering=popular', None, None,
+            )),
+            'recipes.search': repeat(lambda: (
+                'GET', f'/api/recipes/?search={rng.choice(words)}', None,
+                None,
+            )),
+            'recipes.author': repeat(lambda: (
+                'GET', f'/api/recipes/?author={rng.choice(authors)}', None,
+                None,
+            )),
+            'recipes.favorited': repeat(lambda: (
+                'GET', '/api/recipes/?is_favorited=1', user(), None,
+            )),
+            'recipes.detail': repeat(lambda: (
+                'GET', f'/api/recipes/{rng.choice(recipe_ids)}/', user(),
+                None,
+            )),
+            'ingredients.prefix': repeat(lambda: (
+                'GET', f'/api/ingredients/?name={rng.choice(names)[:3]}',
+                None, None,
+            )),
+            'tags.list': repeat(lambda: ('GET', '/api/tags/', None, None)),
+            'users.me': repeat(lambda: ('GET', '/api/users/me/', user(),
+                                        None)),
+            'users.subscriptions': repeat(lambda: (
+                'GET', '/api/users/subscriptions/?recipes_limit=3', user(),
+                None,
+            )),
+            'recipes.download_shopping_cart': repeat(lambda: (
+                'GET', '/api/recipes/download_shopping_cart/', user(), None,
+            )),
+            'recipes.favorite.toggle': toggle,
+        }
+
+    @staticmethod
+    def sample_recipes(rng):
+        """До RECIPE_SAMPLE id рецептов без загрузки всех id."""
+        bounds = Recipe.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            raise CommandError('Нет данных: сначала запустите seed_data')
+        span = range(bounds['low'], bounds['high'] + 1)
+        candidates = rng.sample(span, min(RECIPE_SAMPLE, len(span)))
+        return sorted(Recipe.objects.filter(
+            pk__in=candidates).values_list('pk', flat=True))
+
+    @staticmethod
+    def free_pairs(rng, user_ids, recipe_ids):
+        """Различные пары пользователь-рецепт, которых нет в избранном."""
+        taken = set(Favorite.objects.filter(
+            user_id__in=user_ids, recipe_id__in=recipe_ids
+        ).values_list('user_id', 'recipe_id'))
+        free = [
+            (user_id, recipe_id)
+            for user_id in user_ids for recipe_id in recipe_ids
+            if (user_id, recipe_id) not in taken
+        ]
+        return rng.sample(free, min(TOGGLE_PAIRS, len(free)))
+
+    def restore(self):
+        """Убирает из избранного пары, оставшиеся после прерванного замера."""
+        left = Favorite.objects.filter(
+            user_id__in={user_id for user_id, _ in self.toggled},
+            recipe_id__in={recipe_id for _, recipe_id in self.toggled},
+        ).values_list('user_id', 'recipe_id')
+        pairs = set(self.toggled)
+        recipes = {}
+        for user_id, recipe_id in left:
+            if (user_id, recipe_id) in pairs:
+                recipes.setdefault(user_id, []).append(recipe_id)
+        for user in User.objects.filter(pk__in=recipes):
+            Favorite.objects.remove(user, recipes[user.pk])
+
+    @staticmethod
+    def run(transport, requests, total, concurrency, warmup):
+        def steps(index):
+            entry = requests[index % len(requests)]
+            return entry if isinstance(entry[0], tuple) else (entry,)
+
+        for index in range(warmup):
+            for step in steps(index):
+                transport(*step)
+        samples = []
+        lock = threading.Lock()
+
+        def work(index):
+            try:
+                done = [transport(*step) for step in steps(index)]
+            finally:
+                connections.close_all()
+            with lock:
+                samples.extend(done)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(work, range(total)))
+        wall = time.perf_counter() - started
+        latencies = [elapsed * 1000 for _, elapsed, _ in samples]
+        queries = [count for _, _, count in samples if count is not None]
+        errors = sum(status >= 400 for status, _, _ in samples)
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'rps': round(len(samples) / wall, 1),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries': (
+                round(sum(queries) / len(queries), 1) if queries else None
+            ),
+        }
+
+    def report(self, name, result):
+        queries = result['queries']
+        self.stdout.write(
+            f'{name:32} p50 {result["p50_ms"]:8.2f}  '
+            f'p95 {result["p95_ms"]:8.2f}  p99 {result["p99_ms"]:8.2f} мс  '
+            f'{result["rps"]:7.1f} запр/с  '
+            f'SQL {"-" if queries is None else queries}'
+            + (f'  ошибок {result["errors"]}' if result['errors'] else '')
+        )
+
+    @staticmethod
+    def meta(options):
+        return {
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'transport': options['url'] or 'in-process',
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'seed': options['seed'],
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+                'follows': Follow.objects.count(),
+            },
+        }
+
+    def compare(self, path, results, threshold):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = []
+        for name, result in results.items():
+            before = baseline['results'].get(name)
+            if before is None:
+                continue
+            growth = (result['p95_ms'] / before['p95_ms'] - 1) * 100
+            line = f'{name:32} p95 {growth:+6.1f}%'
+            if result['queries'] is not None and before['queries'] is not None:
+                line += f'  SQL {before["queries"]} -> {result["queries"]}'
+                # Среднее плавает из-за кешей; лишний запрос на каждый
+                # ответ даёт рост хотя бы на единицу.
+                if result['queries'] - before['queries'] >= QUERIES_SLACK:
+                    regressions.append(name)
+            if growth > threshold and name not in regressions:
+                regressions.append(name)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f'Регрессия относительно {baseline["meta"]["commit"]}: '
+                f'{", ".join(regressions)}'
+            )
@@ -0,0 +1,88 @@
+import io
+import timeit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import renderers
+from api.renderers import FastJSONParser, FastJSONRenderer
+from api.serializers import IngredientSerializer, RecipeSerializer
+from recipes.models import Ingredient, Recipe
+
+
+def measure(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает штатный и быстрый JSON-рендереры на ответах API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=100,
+            help='Сколько рецептов сериализовать в выдаче /api/recipes/',
+        )
+        parser.add_argument(
+            '--number',
+            type=int,
+            default=50,
+            help='Сколько раз повторять каждый замер',
+        )
+
+    def handle(self, *args, **options):
+        if not renderers.ENABLED:
+            raise CommandError(
+                'orjson не установлен или не включён через API_FAST_JSON=true'
+            )
+        for name, data in self.payloads(options['recipes']).items():
+            stock = JSONRenderer().render(data)
+            fast = FastJSONRenderer().render(data)
+            if stock != fast:
+                raise CommandError(f'{name}: вывод рендереров различается')
+            render = (
+                measure(lambda: JSONRenderer().render(data),
+                        options['number']),
+                measure(lambda: FastJSONRenderer().render(data),
+                        options['number']),
+            )
+            parse = (
+                measure(lambda: JSONParser().parse(io.BytesIO(stock)),
+                        options['number']),
+                measure(lambda: FastJSONParser().parse(io.BytesIO(stock)),
+                        options['number']),
+            )
+            self.stdout.write(
+                f'{name}: {len(stock) / 1024:.1f} КБ\n'
+                f'  рендер {render[0] * 1000:.2f} мс -> '
+                f'{render[1] * 1000:.2f} мс (x{render[0] / render[1]:.1f})\n'
+                f'  разбор {parse[0] * 1000:.2f} мс -> '
+                f'{parse[1] * 1000:.2f} мс (x{parse[0] / parse[1]:.1f})'
+            )
+
+    @staticmethod
+    def payloads(recipes_count):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = AnonymousUser()
+        recipes = Recipe.objects.select_related('author').prefetch_related(
+            'tags', 'recipe_ingredients__ingredient'
+        ).defer('search_vector').order_by('-id')[:recipes_count]
+        results = RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        ).data
+        return {
+            '/api/recipes/': {
+                'count': len(results),
+                'next': None,
+                'previous': None,
+                'results': results,
+            },
+            '/api/ingredients/': IngredientSerializer(
+                Ingredient.objects.all(), many=True
+            ).data,
+        }
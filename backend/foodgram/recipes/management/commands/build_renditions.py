@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.renditions import build_renditions, needs_renditions
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии изображений существующих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать копии даже там, где они уже есть',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Число потоков обработки',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True).only('id', 'image', 'renditions')
+        ids = [
+            recipe.pk for recipe in recipes.iterator()
+            if options['force'] or needs_renditions(recipe)
+        ]
+        if options['force']:
+            Recipe.objects.filter(pk__in=ids).update(renditions={})
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            list(executor.map(build_renditions, ids))
+        done = sum(
+            not needs_renditions(recipe)
+            for recipe in recipes.filter(pk__in=ids)
+        )
+        self.stdout.write(f'Обработано изображений: {done} из {len(ids)}')
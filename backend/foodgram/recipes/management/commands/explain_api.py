@@ -0,0 +1,425 @@
+import base64
+import io
+import json
+import re
+import tempfile
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import URLResolver, reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api import urls as api_urls
+from api.authentication import CachedTokenAuthentication, local_tokens
+from api.ingredient_index import ingredient_index
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import Follow, User
+
+from .bench_api import git_commit
+from .seed_data import PASSWORD, PREFIX
+
+METHODS = ('get', 'post', 'put', 'patch', 'delete')
+DUMMY_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+}
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+SPACES = re.compile(r'\s+')
+
+# (подпись, имя маршрута, метод, кто ходит, аргументы пути, query, тело).
+# Кто ходит: None — аноним, 'user' — пользователь набора, 'staff' —
+# он же с is_staff. Подстановки {...} берутся из Command.fixtures().
+SCENARIOS = (
+    ('root', 'api-root', 'get', None, {}, '', None),
+    ('stats', 'cache_stats', 'get', 'staff', {}, '', None),
+    ('metrics', 'metrics', 'get', 'staff', {}, '', None),
+    ('login', 'login', 'post', None, {}, '', lambda ctx: {
+        'email': ctx['email'], 'password': PASSWORD}),
+    ('logout', 'logout', 'post', 'user', {}, '', None),
+    ('list', 'user-list', 'get', 'user', {}, '?limit=6', None),
+    ('register', 'user-list', 'post', None, {}, '', lambda ctx: {
+        'email': 'explain@example.com', 'username': 'explain',
+        'first_name': 'Аудит', 'last_name': 'Аудит',
+        'password': 'Explain-password-1'}),
+    ('me', 'user-get-me', 'get', 'user', {}, '', None),
+    ('detail', 'user-detail', 'get', 'user', {'id': '{author}'}, '', None),
+    ('set password', 'user-set-password', 'post', 'user', {}, '',
+     lambda ctx: {'current_password': PASSWORD,
+                  'new_password': 'Explain-password-2'}),
+    ('subscriptions', 'user-subscriptions', 'get', 'user', {},
+     '?recipes_limit=3', None),
+    ('subscribe', 'user-subscribe', 'post', 'user',
+     {'id': '{stranger}'}, '', None),
+    ('unsubscribe', 'user-subscribe', 'delete', 'user',
+     {'id': '{author}'}, '', None),
+    ('list', 'ingredient-list', 'get', None, {}, '', None),
+    ('prefix', 'ingredient-list', 'get', None, {}, '?name={prefix}', None),
+    ('detail', 'ingredient-detail', 'get', None,
+     {'pk': '{ingredient}'}, '', None),
+    ('list', 'tag-list', 'get', None, {}, '', None),
+    ('detail', 'tag-detail', 'get', None, {'pk': '{tag}'}, '', None),
+    ('list', 'recipe-list', 'get', None, {}, '', None),
+    ('list auth', 'recipe-list', 'get', 'user', {}, '', None),
+    ('cards', 'recipe-list', 'get', None, {},
+     '?fields=id,name,image,cooking_time', None),
+    ('tags', 'recipe-list', 'get', None, {}, '?tags={tag_slug}', None),
+    ('author', 'recipe-list', 'get', None, {}, '?author={author}', None),
+    ('popular', 'recipe-list', 'get', None, {}, '?ordering=popular', None),
+    ('search', 'recipe-list', 'get', None, {}, '?search={word}', None),
+    ('cursor', 'recipe-list', 'get', None, {}, '?pagination=cursor', None),
+    ('favorited', 'recipe-list', 'get', 'user', {}, '?is_favorited=1',
+     None),
+    ('in cart', 'recipe-list', 'get', 'user', {},
+     '?is_in_shopping_cart=1', None),
+    ('create', 'recipe-list', 'post', 'user', {}, '',
+     lambda ctx: ctx['recipe_data']),
+    ('detail', 'recipe-detail', 'get', 'user', {'pk': '{recipe}'}, '',
+     None),
+    ('update', 'recipe-detail', 'patch', 'user', {'pk': '{own_recipe}'},
+     '', lambda ctx: ctx['recipe_data']),
+    ('delete', 'recipe-detail', 'delete', 'user', {'pk': '{own_recipe}'},
+     '', None),
+    ('download', 'recipe-download-shopping-cart', 'get', 'user', {}, '',
+     None),
+    ('add', 'recipe-favorite', 'post', 'user', {'pk': '{recipe}'}, '',
+     None),
+    ('remove', 'recipe-favorite', 'delete', 'user',
+     {'pk': '{favorite}'}, '', None),
+    ('add', 'recipe-shopping-cart', 'post', 'user', {'pk': '{recipe}'},
+     '', None),
+    ('remove', 'recipe-shopping-cart', 'delete', 'user',
+     {'pk': '{in_cart}'}, '', None),
+    ('add', 'recipe-favorite-batch', 'post', 'user', {}, '',
+     lambda ctx: {'recipes': ctx['batch']}),
+    ('remove', 'recipe-favorite-batch', 'delete', 'user', {}, '',
+     lambda ctx: {'recipes': ctx['batch']}),
+    ('add', 'recipe-shopping-cart-batch', 'post', 'user', {}, '',
+     lambda ctx: {'recipes': ctx['batch']}),
+    ('remove', 'recipe-shopping-cart-batch', 'delete', 'user', {}, '',
+     lambda ctx: {'recipes': ctx['batch']}),
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+def routes(patterns, prefix='', seen=None):
+    """Маршруты API в порядке разрешения, перекрытые пропускаются."""
+    seen = set() if seen is None else seen
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from routes(
+                pattern.url_patterns, prefix + str(pattern.pattern), seen)
+            continue
+        route = prefix + str(pattern.pattern)
+        if 'format' in pattern.pattern.regex.groupindex or route in seen:
+            continue
+        seen.add(route)
+        actions = getattr(pattern.callback, 'actions', None)
+        view = getattr(pattern.callback, 'cls', None)
+        if actions:
+            methods = tuple(method for method in METHODS if method in actions)
+        else:
+            methods = tuple(
+                method for method in METHODS if hasattr(view, method))
+        yield route, pattern.name, methods
+
+
+def normalize(sql):
+    return SPACES.sub(' ', IN_LIST.sub('IN (...)', sql)).strip()
+
+
+def tiny_png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (200, 120, 40)).save(buffer, 'PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет все маршруты API, снимает планы их SQL-запросов '
+            'и пишет JSON-отчёт с найденными проблемами')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', default='explain_api.json',
+            help='Куда записать отчёт',
+        )
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='С какого размера таблицы полный скан считается проблемой',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Сколько одинаковых запросов за ответ считать N+1',
+        )
+        parser.add_argument(
+            '--only', nargs='+', metavar='ROUTE',
+            help='Проверить только маршруты с этими именами',
+        )
+
+    def handle(self, *args, **options):
+        self.min_rows = options['min_rows']
+        self.repeat = options['repeat']
+        self.sizes = self.table_sizes()
+        ctx = self.fixtures()
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options['only'] or scenario[1] in options['only']
+        ]
+        covered = {(scenario[1], scenario[2]) for scenario in scenarios}
+        uncovered = [
+            {'route': route, 'name': name, 'method': method.upper()}
+            for route, name, methods in routes(api_urls.urlpatterns)
+            for method in methods
+            if (name, method) not in covered
+            and (not options['only'] or name in options['only'])
+        ]
+        # Кеш ответов и индекс ингредиентов в памяти прячут запросы
+        # к базе; аудит смотрит на путь промаха. Файлы изображений
+        # откатом транзакции не удаляются, поэтому пишутся во временный
+        # каталог.
+        with tempfile.TemporaryDirectory() as media, \
+                override_settings(CACHES=DUMMY_CACHE, MEDIA_ROOT=media), \
+                ingredient_index.bypass():
+            results = [self.audit(ctx, *scenario) for scenario in scenarios]
+        flags = Counter(
+            flag['type'] for result in results for flag in result['flags'])
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'database': connection.vendor,
+                'min_rows': self.min_rows,
+                'repeat': options['repeat'],
+                'tables': self.sizes,
+            },
+            'summary': dict(sorted(flags.items())),
+            'routes': results,
+            'uncovered': uncovered,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        for result in results:
+            if result['flags']:
+                self.stdout.write(
+                    f'{result["method"]} {result["path"]} '
+                    f'({result["label"]}): '
+                    + ', '.join(sorted({
+                        flag['type'] for flag in result['flags']}))
+                )
+        self.stdout.write(
+            f'Маршрутов {len(results)}, без сценария {len(uncovered)}, '
+            f'замечаний {sum(flags.values())}; отчёт в {options["output"]}'
+        )
+
+    def fixtures(self):
+        """Объекты набора seed_data, на которых гоняются сценарии."""
+        user = (
+            User.objects.filter(username__startswith=PREFIX)
+            .exclude(recipes=None).exclude(follower=None)
+            .exclude(favorites=None).exclude(shopping_list=None)
+            .order_by('pk').first()
+        )
+        if user is None:
+            raise CommandError('Нет данных: сначала запустите seed_data')
+        recipe = Recipe.objects.exclude(author=user).exclude(
+            favorites__user=user).exclude(shopping_list__user=user).first()
+        followed = Follow.objects.filter(user=user).values('author')
+        stranger = User.objects.exclude(pk=user.pk).exclude(
+            pk__in=followed).order_by('pk').first()
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)[:5])
+        tag = Tag.objects.order_by('pk').first()
+        return {
+            'user': user,
+            'token': Token.objects.get_or_create(user=user)[0].key,
+            'email': user.email,
+            'author': followed.order_by('author')[0]['author'],
+            'stranger': stranger.pk,
+            'recipe': recipe.pk,
+            'own_recipe': user.recipes.order_by('pk').first().pk,
+            'favorite': user.favorites.order_by('pk').first().recipe_id,
+            'in_cart': user.shopping_list.order_by('pk').first().recipe_id,
+            'batch': list(
+                Recipe.objects.exclude(author=user)
+                .order_by('-pk').values_list('pk', flat=True)[:20]),
+            'ingredient': ingredients[0],
+            'prefix': Ingredient.objects.get(pk=ingredients[0]).name[:3],
+            'tag': tag.pk,
+            'tag_slug': tag.slug,
+            'word': recipe.name.split()[0],
+            'recipe_data': {
+                'ingredients': [
+                    {'id': pk, 'amount': 10} for pk in ingredients],
+                'tags': [tag.pk],
+                'image': tiny_png(),
+                'name': 'Аудит планов',
+                'text': 'Рецепт для проверки планов запросов.',
+                'cooking_time': 10,
+            },
+        }
+
+    def audit(self, ctx, label, name, method, auth, kwargs, query, data):
+        path = reverse(
+            f'api:{name}',
+            kwargs={key: value.format(**ctx) for key, value in kwargs.items()}
+        ) + query.format(**ctx)
+        client = Client(HTTP_HOST=next(
+            (host for host in settings.ALLOWED_HOSTS if '*' not in host),
+            'localhost',
+        ))
+        extra = {}
+        if data is not None:
+            extra = {
+                'data': json.dumps(data(ctx)),
+                'content_type': 'application/json',
+            }
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                if not many:
+                    statements.append(
+                        (sql, params, time.perf_counter() - started))
+
+        result = {'route': name, 'label': label, 'method': method.upper(),
+                  'path': path}
+        try:
+            with transaction.atomic():
+                if auth:
+                    if auth == 'staff':
+                        User.objects.filter(pk=ctx['user'].pk).update(
+                            is_staff=True)
+                    # Токен уже в кеше процесса, как на рабочем сервере.
+                    CachedTokenAuthentication().authenticate_credentials(
+                        ctx['token'])
+                    extra['HTTP_AUTHORIZATION'] = f'Token {ctx["token"]}'
+                with connection.execute_wrapper(capture):
+                    response = getattr(client, method)(path, **extra)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                result['status'] = response.status_code
+                result.update(self.analyze(statements))
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            local_tokens.clear()
+        return result
+
+    def analyze(self, statements):
+        groups = Counter(normalize(sql) for sql, _, _ in statements)
+        flags = [
+            {'type': 'n_plus_one', 'sql': sql, 'count': count}
+            for sql, count in groups.items()
+            if count >= self.repeat
+        ]
+        explained = []
+        for sql, params, elapsed in statements:
+            entry = {
+                'sql': normalize(sql),
+                'ms': round(elapsed * 1000, 2),
+            }
+            if sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                plan, problems = self.explain(sql, params)
+                entry['plan'] = plan
+                for problem in problems:
+                    flags.append({**problem, 'sql': entry['sql']})
+            explained.append(entry)
+        return {
+            'queries': len(statements),
+            'ms': round(sum(elapsed for *_, elapsed in statements) * 1000,
+                        2),
+            'flags': flags,
+            'statements': explained,
+        }
+
+    def explain(self, sql, params):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(
+                        'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql,
+                        params)
+                    return self.postgres_plan(cursor.fetchone()[0])
+                if connection.vendor == 'sqlite':
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                    return self.sqlite_plan(cursor.fetchall())
+                cursor.execute('EXPLAIN ' + sql, params)
+                return [str(row) for row in cursor.fetchall()], []
+        except DatabaseError as error:
+            return [f'EXPLAIN не выполнен: {error}'], []
+
+    def postgres_plan(self, plan):
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        lines, problems = [], []
+
+        def walk(node, depth):
+            relation = node.get('Relation Name')
+            line = node['Node Type']
+            if node.get('Index Name'):
+                line += f' using {node["Index Name"]}'
+            if relation:
+                line += f' on {relation}'
+            lines.append('  ' * depth + line)
+            if (node['Node Type'] == 'Seq Scan'
+                    and self.sizes.get(relation, 0) >= self.min_rows):
+                problems.append({
+                    'type': 'seq_scan', 'table': relation,
+                    'rows': node.get('Actual Rows'),
+                })
+            if node.get('Sort Space Type') == 'Disk':
+                problems.append({
+                    'type': 'sort_spill',
+                    'kb': node.get('Sort Space Used'),
+                })
+            for child in node.get('Plans', ()):
+                walk(child, depth + 1)
+
+        walk(plan[0]['Plan'], 0)
+        return lines, problems
+
+    def sqlite_plan(self, rows):
+        depth = {0: -1}
+        lines, problems = [], []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+            words = detail.split()
+            if (words[0] == 'SCAN' and len(words) == 2
+                    and self.sizes.get(words[1], 0) >= self.min_rows):
+                problems.append({'type': 'seq_scan', 'table': words[1]})
+            if detail.startswith('USE TEMP B-TREE'):
+                # SQLite не говорит, ушла ли сортировка на диск; ближайший
+                # сигнал — сортировка без подходящего индекса.
+                problems.append({'type': 'temp_sort', 'detail': detail})
+        return lines, problems
+
+    @staticmethod
+    def table_sizes():
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT relname, reltuples::bigint FROM pg_class "
+                    "WHERE relkind = 'r' AND relnamespace = "
+                    "'public'::regnamespace"
+                )
+                return dict(sorted(cursor.fetchall()))
+            sizes = {}
+            for table in sorted(connection.introspection.table_names()):
+                cursor.execute(
+                    f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                sizes[table] = cursor.fetchone()[0]
+            return sizes
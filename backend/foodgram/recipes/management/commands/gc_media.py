@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from recipes.models import ImageBlob, Recipe
+from recipes.renditions import delete_renditions
+from recipes.storage import content_storage
+
+UPLOAD_DIR = Recipe._meta.get_field('image').upload_to
+
+
+def walk(storage, directory):
+    directories, files = storage.listdir(directory)
+    for filename in files:
+        yield f'{directory}/{filename}'
+    for name in directories:
+        if name != 'renditions':
+            yield from walk(storage, f'{directory}/{name}')
+
+
+def is_referenced(name):
+    return Recipe.objects.filter(image=name).exists()
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы изображений, на которые не ссылается ни один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=24,
+            help='Не трогать файлы моложе указанного числа часов',
+        )
+        parser.add_argument(
+            '--scan',
+            action='store_true',
+            help='Проверить также файлы, которых нет в учёте',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+        candidates = set(
+            ImageBlob.objects.filter(
+                references__lte=0, updated__lt=cutoff
+            ).values_list('name', flat=True)
+        )
+        if options['scan'] and content_storage.exists(UPLOAD_DIR):
+            known = set(ImageBlob.objects.values_list('name', flat=True))
+            candidates.update(
+                name for name in walk(content_storage, UPLOAD_DIR)
+                if name not in known
+                and content_storage.get_modified_time(name) < cutoff
+            )
+        referenced = dict(
+            Recipe.objects.filter(image__in=candidates)
+            .values('image').annotate(total=Count('id'))
+            .order_by().values_list('image', 'total')
+        )
+        for name, total in referenced.items():
+            ImageBlob.objects.update_or_create(
+                name=name, defaults={'references': total}
+            )
+        garbage = sorted(candidates - referenced.keys())
+        if options['dry_run']:
+            for name in garbage:
+                self.stdout.write(name)
+        else:
+            garbage = [name for name in garbage if self.collect(name)]
+        freed = 'найдено' if options['dry_run'] else 'удалено'
+        self.stdout.write(
+            f'Файлов {freed}: {len(garbage)}, '
+            f'исправлено счётчиков: {len(referenced)}'
+        )
+
+    def collect(self, name):
+        """Удаляет файл, если на него по-прежнему никто не ссылается.
+
+        Строка учёта блокируется, поэтому сохранение рецепта с этим файлом
+        ждёт конца удаления. Загрузка тех же байтов могла вернуть имя ещё
+        до удаления файла, поэтому после удаления ссылки проверяются снова
+        и при необходимости файл восстанавливается.
+        """
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(
+                name=name).first()
+            if blob is not None and blob.references > 0:
+                return False
+            if is_referenced(name):
+                return False
+            content = None
+            if content_storage.exists(name):
+                with content_storage.open(name) as file:
+                    content = file.read()
+                content_storage.delete(name)
+            if blob is not None:
+                blob.delete()
+        if is_referenced(name) or ImageBlob.objects.filter(
+                name=name, references__gt=0).exists():
+            if content is not None:
+                content_storage.restore(name, ContentFile(content))
+            ImageBlob.objects.get_or_create(name=name, defaults={
+                'references': Recipe.objects.filter(image=name).count()
+            })
+            return False
+        delete_renditions(name)
+        self.stdout.write(name)
+        return True
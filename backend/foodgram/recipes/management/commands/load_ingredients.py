@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import bump_generation
+from api.ingredient_index import ingredient_index
+from recipes.models import Ingredient
+
+BATCH_SIZE = 5000
+READ_SIZE = 64 * 1024
+
+
+class Rollback(Exception):
+    pass
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            yield item['name'], item['measurement_unit']
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise CommandError('Файл JSON обрывается')
+            return
+
+
+READERS = {'.csv': read_csv, '.json': read_json}
+
+
+def scaled(rows, scale):
+    for row in rows:
+        yield row
+        for copy in range(1, scale):
+            yield f'{row[0]} #{copy}', row[1]
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к ingredients.csv или .json')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Размер пакета вставки',
+        )
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='Замерить загрузку и откатить транзакцию',
+        )
+        parser.add_argument(
+            '--scale',
+            type=int,
+            default=1,
+            help='Размножить каталог в N раз (для замера)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                with open(path, encoding='utf-8') as file:
+                    read, created = self.load(
+                        scaled(reader(file), options['scale']),
+                        options['batch_size'],
+                    )
+                if options['benchmark']:
+                    raise Rollback
+        except Rollback:
+            pass
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Прочитано {read}, добавлено {created} за {elapsed:.2f} с '
+            f'({read / elapsed:.0f} строк/с)'
+        )
+        if options['benchmark']:
+            self.stdout.write('Режим замера: изменения отменены')
+        elif created:
+            ingredient_index.invalidate()
+            bump_generation()
+
+    def load(self, rows, batch_size):
+        """Возвращает число прочитанных и действительно добавленных строк.
+
+        С ignore_conflicts база не сообщает, сколько строк пропущено, поэтому
+        добавленные считаются по числу строк таблицы до и после загрузки.
+        """
+        before = Ingredient.objects.count()
+        seen = set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+            .iterator()
+        )
+        batch = []
+        read = 0
+        for name, measurement_unit in rows:
+            read += 1
+            key = (name.strip(), measurement_unit.strip())
+            if key in seen:
+                continue
+            seen.add(key)
+            batch.append(Ingredient(name=key[0], measurement_unit=key[1]))
+            if len(batch) >= batch_size:
+                self.flush(batch)
+        self.flush(batch)
+        return read, Ingredient.objects.count() - before
+
+    @staticmethod
+    def flush(batch):
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        batch.clear()
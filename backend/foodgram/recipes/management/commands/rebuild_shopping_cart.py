@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import IngredientsRecipe, ShoppingCartItem, ShoppingList
+
+USERS_PER_BATCH = 200
+TOLERANCE = 1e-6
+
+
+def live_totals(user_ids):
+    rows = IngredientsRecipe.objects.filter(
+        recipe__shopping_list__user_id__in=user_ids)
+    return {
+        (row['recipe__shopping_list__user_id'], row['ingredient_id']):
+            (row['total'], row['recipes'])
+        for row in ShoppingCartItem.objects.live_totals(rows).iterator()
+    }
+
+
+def stored_totals(user_ids):
+    return {
+        (user_id, ingredient_id): (amount, recipes_count)
+        for user_id, ingredient_id, amount, recipes_count
+        in ShoppingCartItem.objects.filter(user_id__in=user_ids).values_list(
+            'user_id', 'ingredient_id', 'amount', 'recipes_count'
+        ).iterator()
+    }
+
+
+def diff(expected, actual):
+    mismatched = []
+    for key in expected.keys() | actual.keys():
+        want, got = expected.get(key), actual.get(key)
+        if (want is None or got is None or want[1] != got[1]
+                or abs(want[0] - got[0]) > TOLERANCE):
+            mismatched.append((key, want, got))
+    return mismatched
+
+
+def user_batches():
+    """Пользователи с корзиной или с суммами, пачками по возрастанию id."""
+    user_ids = sorted(
+        set(ShoppingList.objects.values_list('user_id', flat=True)
+            .distinct().iterator())
+        | set(ShoppingCartItem.objects.values_list('user_id', flat=True)
+              .distinct().iterator())
+    )
+    for start in range(0, len(user_ids), USERS_PER_BATCH):
+        yield user_ids[start:start + USERS_PER_BATCH]
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает суммы списков покупок и сверяет их с корзинами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить суммы, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        written = 0
+        mismatched = []
+        # Каждая пачка пересчитывается и сверяется в своей транзакции под
+        # блокировкой пользователей, поэтому параллельные изменения корзин
+        # не попадают между расчётом и записью.
+        for user_ids in user_batches():
+            with transaction.atomic():
+                ShoppingCartItem.objects.lock_users(user_ids)
+                if not options['check']:
+                    ShoppingCartItem.objects.refresh(user_ids)
+                stored = stored_totals(user_ids)
+                written += len(stored)
+                mismatched.extend(diff(live_totals(user_ids), stored))
+        if not options['check']:
+            self.stdout.write(f'Записано строк: {written}')
+        for (user_id, ingredient_id), want, got in mismatched[:20]:
+            self.stderr.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'ожидалось {want}, сохранено {got}'
+            )
+        if mismatched:
+            raise CommandError(f'Расхождений: {len(mismatched)}')
+        self.stdout.write(self.style.SUCCESS('Суммы совпадают с корзинами'))
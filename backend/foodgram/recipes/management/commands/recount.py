@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe
+from users.models import Follow, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(**{related_field: OuterRef('pk')})
+            .order_by()
+            .values(related_field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики избранного, рецептов и подписчиков'
+
+    def handle(self, *args, **options):
+        for model, counter, related_model, related_field in COUNTERS:
+            actual = actual_count(related_model, related_field)
+            with transaction.atomic():
+                drifted = list(
+                    model.objects.annotate(actual=actual)
+                    .exclude(**{counter: F('actual')})
+                    .values_list('pk', flat=True)
+                )
+                model.objects.filter(pk__in=drifted).update(
+                    **{counter: actual})
+            self.stdout.write(
+                f'{model.__name__}.{counter}: исправлено {len(drifted)}'
+            )
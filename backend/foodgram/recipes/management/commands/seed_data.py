@@ -0,0 +1,234 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import bump_generation
+from api.ingredient_index import ingredient_index
+from api.search import get_search_backend
+from recipes.models import (Favorite, Ingredient, IngredientsRecipe, Recipe,
+                            ShoppingList, Tag)
+from users.models import Follow, User
+
+PREFIX = 'bench-'
+PASSWORD = 'bench-password'
+BATCH_SIZE = 2000
+SYLLABLES = (
+    'ба', 'ва', 'го', 'да', 'ке', 'ли', 'ма', 'но', 'пе', 'ри', 'со', 'ту',
+    'фа', 'хо', 'це', 'чи', 'ша', 'ер', 'ол', 'ан', 'ус', 'ин', 'ок', 'ят',
+)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+def word(rng, syllables=(2, 4)):
+    return ''.join(
+        rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables))
+    )
+
+
+def stage(seed, name):
+    """Свой генератор на каждый этап: повторный запуск с тем же seed
+    даёт те же строки, и уже созданное не дублируется."""
+    return random.Random(f'{seed}:{name}')
+
+
+def by_index(queryset, field, keys):
+    """id строк набора в порядке их номеров, а не первичных ключей."""
+    ids = dict(queryset.filter(**{f'{field}__in': keys}).values_list(
+        field, 'pk'))
+    return [ids[key] for key in keys if key in ids]
+
+
+def sentence(rng, words):
+    return ' '.join(word(rng) for _ in range(words)).capitalize() + '.'
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу воспроизводимым синтетическим набором для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=2000,
+            help='Сколько синтетических ингредиентов добавить в каталог',
+        )
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--tags', type=int, default=6)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--cart-per-user', type=int, default=5)
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Сначала удалить ранее созданный набор',
+        )
+
+    def handle(self, *args, **options):
+        seed = options['seed']
+        started = time.perf_counter()
+        if options['clear']:
+            self.clear()
+        with transaction.atomic():
+            ingredient_ids = self.ingredients(
+                stage(seed, 'ingredients'), options['ingredients'])
+            tag_ids = self.tags(stage(seed, 'tags'), options['tags'])
+            user_ids = self.users(options['users'])
+            recipe_ids = self.recipes(
+                stage(seed, 'recipes'), user_ids, options['recipes'])
+            self.compositions(
+                seed, recipe_ids, ingredient_ids,
+                tag_ids, options['ingredients_per_recipe'],
+            )
+            self.relations(stage(seed, 'follows'), Follow, 'author_id',
+                           user_ids, user_ids, options['follows_per_user'])
+            self.relations(stage(seed, 'favorites'), Favorite, 'recipe_id',
+                           user_ids, recipe_ids,
+                           options['favorites_per_user'])
+            self.relations(stage(seed, 'cart'), ShoppingList, 'recipe_id',
+                           user_ids, recipe_ids, options['cart_per_user'])
+        call_command('recount', stdout=self.stdout)
+        call_command('rebuild_shopping_cart', stdout=self.stdout)
+        get_search_backend().rebuild()
+        ingredient_index.invalidate()
+        bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей {len(user_ids)}, рецептов {len(recipe_ids)}, '
+            f'ингредиентов в каталоге {len(ingredient_ids)} '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
+
+    def clear(self):
+        with transaction.atomic():
+            User.objects.filter(username__startswith=PREFIX).delete()
+            Tag.objects.filter(slug__startswith=PREFIX).delete()
+            Ingredient.objects.filter(name__startswith=PREFIX).delete()
+
+    # Состав набора зависит только от seed и размеров: строки набора
+    # опознаются по именам с номером, а всё, что уже есть в базе помимо
+    # набора, не влияет ни на генераторы, ни на выбор связей.
+
+    @staticmethod
+    def ingredients(rng, count):
+        items = [
+            Ingredient(
+                name=f'{PREFIX}{word(rng)} {index}',
+                measurement_unit=rng.choice(UNITS),
+            )
+            for index in range(count)
+        ]
+        Ingredient.objects.bulk_create(
+            items, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        return by_index(
+            Ingredient.objects, 'name', [item.name for item in items])
+
+    @staticmethod
+    def tags(rng, count):
+        colors = set()
+        created = []
+        for index in range(count):
+            color = f'#{rng.randrange(0x1000000):06X}'
+            while color in colors:
+                color = f'#{rng.randrange(0x1000000):06X}'
+            colors.add(color)
+            created.append(Tag(
+                name=f'{PREFIX}{word(rng)} {index}',
+                slug=f'{PREFIX}{index}',
+                color=color,
+            ))
+        Tag.objects.bulk_create(created, ignore_conflicts=True)
+        return by_index(Tag.objects, 'slug', [tag.slug for tag in created])
+
+    @staticmethod
+    def users(count):
+        password = make_password(PASSWORD)
+        usernames = [f'{PREFIX}{index}' for index in range(count)]
+        existing = set(User.objects.filter(
+            username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create(
+            (
+                User(
+                    username=username,
+                    email=f'{username}@example.com',
+                    first_name='Бенч',
+                    last_name=str(index),
+                    password=password,
+                )
+                for index, username in enumerate(usernames)
+                if username not in existing
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        return by_index(User.objects, 'username', usernames)
+
+    @staticmethod
+    def recipes(rng, user_ids, count):
+        # Генератор проходит весь набор при каждом запуске, а в базу
+        # попадают только недостающие рецепты, поэтому дозапуск даёт те же
+        # строки, что и запуск на пустой базе.
+        items = [
+            Recipe(
+                author_id=rng.choice(user_ids),
+                name=sentence(rng, rng.randint(1, 4))[:-1],
+                text=' '.join(
+                    sentence(rng, rng.randint(4, 12))
+                    for _ in range(rng.randint(2, 8))
+                ),
+                cooking_time=rng.randint(5, 180),
+            )
+            for _ in range(count)
+        ]
+        existing = Recipe.objects.filter(author_id__in=user_ids).count()
+        Recipe.objects.bulk_create(items[existing:], batch_size=BATCH_SIZE)
+        return list(
+            Recipe.objects.filter(author_id__in=user_ids)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    @staticmethod
+    def compositions(seed, recipe_ids, ingredient_ids, tag_ids, per_recipe):
+        filled = set(
+            IngredientsRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .values_list('recipe_id', flat=True).distinct()
+        )
+        per_recipe = min(per_recipe, len(ingredient_ids))
+        ingredients, tags = [], []
+        for position, recipe_id in enumerate(recipe_ids):
+            if recipe_id in filled:
+                continue
+            rng = stage(seed, f'composition:{position}')
+            ingredients.extend(
+                IngredientsRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.randint(1, 500),
+                )
+                for ingredient_id in rng.sample(ingredient_ids, per_recipe)
+            )
+            tags.extend(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for tag_id in rng.sample(
+                    tag_ids, min(len(tag_ids), rng.randint(1, 3)))
+            )
+        IngredientsRecipe.objects.bulk_create(
+            ingredients, batch_size=BATCH_SIZE)
+        Recipe.tags.through.objects.bulk_create(tags, batch_size=BATCH_SIZE)
+
+    @staticmethod
+    def relations(rng, model, field, user_ids, target_ids, per_user):
+        rows = []
+        for user_id in user_ids:
+            targets = rng.sample(target_ids, min(per_user, len(target_ids)))
+            rows.extend(
+                model(user_id=user_id, **{field: target_id})
+                for target_id in targets
+                if not (model is Follow and target_id == user_id)
+            )
+        model.objects.bulk_create(
+            rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
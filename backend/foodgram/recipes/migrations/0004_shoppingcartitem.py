@@ -0,0 +1,61 @@
+# Generated by Django 3.2.16 on 2026-10-17 07:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_cart_items(apps, schema_editor):
+    IngredientsRecipe = apps.get_model('recipes', 'IngredientsRecipe')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    rows = (
+        IngredientsRecipe.objects
+        .filter(recipe__shopping_list__isnull=False)
+        .values('recipe__shopping_list__user_id', 'ingredient_id')
+        .annotate(
+            total=models.Sum('amount'),
+            recipes=models.Count('recipe_id', distinct=True),
+        )
+        .order_by()
+    )
+    ShoppingCartItem.objects.bulk_create(
+        ShoppingCartItem(
+            user_id=row['recipe__shopping_list__user_id'],
+            ingredient_id=row['ingredient_id'],
+            amount=row['total'],
+            recipes_count=row['recipes'],
+        )
+        for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0003_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.FloatField(default=0, verbose_name='Количество')),
+                ('recipes_count', models.IntegerField(default=0, verbose_name='Число рецептов')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списках покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_item'),
+        ),
+        migrations.RunPython(
+            fill_shopping_cart_items, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,139 @@
+# Generated by Django 3.2.16 on 2026-10-17 07:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+import django.db.models.deletion
+
+# Ингредиенты ищутся через name__istartswith, на Postgres это
+# UPPER(name::text) LIKE UPPER('соль%'); обычный индекс по name тут
+# не работает, а функциональный с text_pattern_ops подходит при любой
+# локали базы.
+CREATE_PREFIX_INDEX = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_prefix_idx '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)'
+)
+DROP_PREFIX_INDEX = 'DROP INDEX IF EXISTS ingredient_name_prefix_idx'
+
+
+def merge_duplicates(apps, schema_editor):
+    """Сливает дубли перед созданием уникальных ограничений.
+
+    Одинаковые ингредиенты сводятся к первому, суммы корзин по ним
+    пересчитываются; повторы ингредиента в рецепте складываются.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        # Иначе отложенные проверки внешних ключей не дадут изменить
+        # таблицы дальше в этой же транзакции.
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientsRecipe = apps.get_model('recipes', 'IngredientsRecipe')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    kept = []
+    duplicates = (
+        Ingredient.objects.values('name', 'measurement_unit')
+        .annotate(keep=Min('pk'), total=Count('pk'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        extra = Ingredient.objects.filter(
+            name=row['name'], measurement_unit=row['measurement_unit']
+        ).exclude(pk=row['keep'])
+        IngredientsRecipe.objects.filter(ingredient__in=extra).update(
+            ingredient_id=row['keep'])
+        extra.delete()
+        kept.append(row['keep'])
+    if kept:
+        ShoppingCartItem.objects.filter(ingredient_id__in=kept).delete()
+        ShoppingCartItem.objects.bulk_create(
+            ShoppingCartItem(
+                user_id=row['recipe__shopping_list__user_id'],
+                ingredient_id=row['ingredient_id'],
+                amount=row['total'],
+                recipes_count=row['recipes'],
+            )
+            for row in IngredientsRecipe.objects.filter(
+                ingredient_id__in=kept,
+                recipe__shopping_list__isnull=False,
+            ).values('recipe__shopping_list__user_id', 'ingredient_id')
+            .annotate(total=Sum('amount'),
+                      recipes=Count('recipe_id', distinct=True))
+            .order_by()
+        )
+    duplicates = (
+        IngredientsRecipe.objects.values('recipe', 'ingredient')
+        .annotate(keep=Min('pk'), total=Count('pk'), amount=Sum('amount'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        IngredientsRecipe.objects.filter(pk=row['keep']).update(
+            amount=row['amount'])
+        IngredientsRecipe.objects.filter(
+            recipe_id=row['recipe'], ingredient_id=row['ingredient']
+        ).exclude(pk=row['keep']).delete()
+
+
+def create_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_PREFIX_INDEX)
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_PREFIX_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0008_image_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='favorite',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AlterField(
+            model_name='favorite',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AlterField(
+            model_name='ingredientsrecipe',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='recipes.recipe', verbose_name='рецепт'),
+        ),
+        migrations.AlterField(
+            model_name='shoppinglist',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AlterField(
+            model_name='shoppinglist',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['recipe', 'user'], name='favorite_recipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['user', 'recipe'], name='shopping_list_user_recipe_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientsrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_recipe_ingredient'),
+        ),
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
@@ -1,9 +1,12 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.db.models import UniqueConstraint
+from django.utils import timezone
 
 from colorfield.fields import ColorField
-from users.models import User
+from users.models import User, UserRelationManager
+from .storage import content_storage
 
 
 class Ingredient(models.Model):
@@ -12,10 +15,21 @@ class Ingredient(models.Model):
         max_length=200,
     )
     measurement_unit = models.CharField('Единица измерения', max_length=10)
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'ингредиент'
         verbose_name_plural = 'ингредиенты'
+        constraints = [
+            UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -25,6 +39,11 @@ class Tag(models.Model):
     name = models.CharField('Название тега', unique=True, max_length=200)
     color = ColorField('Цвет', format="hex", unique=True, max_length=7)
     slug = models.SlugField('Slug', unique=True, max_length=200)
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
 
     class Meta:
         verbose_name = 'Тэг'
@@ -46,6 +65,7 @@ class Recipe(models.Model):
     image = models.ImageField(
         "Изображение рецепта",
         upload_to="static/recipe",
+        storage=content_storage,
         blank=True,
         null=True,
     )
@@ -54,6 +74,11 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
     ingredients = models.ManyToManyField(
         Ingredient,
         through='IngredientsRecipe',
@@ -67,11 +92,32 @@ class Recipe(models.Model):
     cooking_time = models.PositiveSmallIntegerField(
         validators=[MinValueValidator(1, 'обычно меньше минуты не готовят')],
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0
+    )
+    renditions = models.JSONField(
+        'Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popularity_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -88,7 +134,8 @@ class IngredientsRecipe(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='рецепт',
-        related_name='recipe_ingredients'
+        related_name='recipe_ingredients',
+        db_index=False
     )
     amount = models.FloatField(
         verbose_name='количество ингридиента',
@@ -98,6 +145,12 @@ class IngredientsRecipe(models.Model):
 
     class Meta:
         verbose_name = 'Ингредиент рецепта'
+        constraints = [
+            UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_recipe_ingredient'
+            )
+        ]
 
 
 class Favorite(models.Model):
@@ -105,15 +158,19 @@ class Favorite(models.Model):
         User,
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
-        related_name='favorites'
+        related_name='favorites',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
-        related_name='favorites'
+        related_name='favorites',
+        db_index=False
     )
 
+    objects = UserRelationManager('recipe')
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -123,6 +180,12 @@ class Favorite(models.Model):
                 name='favorite_unique'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'],
+                name='favorite_recipe_user_idx'
+            ),
+        ]
 
 
 class ShoppingList(models.Model):
@@ -130,15 +193,19 @@ class ShoppingList(models.Model):
         User,
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
-        related_name='shopping_list'
+        related_name='shopping_list',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
-        related_name='shopping_list'
+        related_name='shopping_list',
+        db_index=False
     )
 
+    objects = UserRelationManager('recipe')
+
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
@@ -148,3 +215,155 @@ class ShoppingList(models.Model):
                 name='unique_recipe_list'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'],
+                name='shopping_list_user_recipe_idx'
+            ),
+        ]
+
+
+class ShoppingCartItemManager(models.Manager):
+
+    def lock_users(self, user_ids):
+        list(User.objects.select_for_update().filter(
+            pk__in=user_ids).values_list('pk'))
+
+    def add_recipes(self, user, recipe_ids):
+        self._apply(user, recipe_ids, 1)
+
+    def remove_recipes(self, user, recipe_ids):
+        self._apply(user, recipe_ids, -1)
+
+    def _apply(self, user, recipe_ids, sign):
+        """Прибавляет или вычитает ингредиенты рецептов из сумм корзины."""
+        self.lock_users([user.pk])
+        totals = {
+            row['ingredient_id']: row for row in
+            IngredientsRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .values('ingredient_id').annotate(
+                total=models.Sum('amount'),
+                recipes=models.Count('recipe_id', distinct=True),
+            ).order_by()
+        }
+        existing = {
+            item.ingredient_id: item for item in self.filter(
+                user=user, ingredient_id__in=totals)
+        }
+        created = []
+        for ingredient_id, row in totals.items():
+            item = existing.get(ingredient_id)
+            if item is not None:
+                item.amount = models.F('amount') + sign * row['total']
+                item.recipes_count = (
+                    models.F('recipes_count') + sign * row['recipes'])
+            elif sign > 0:
+                created.append(self.model(
+                    user=user, ingredient_id=ingredient_id,
+                    amount=row['total'], recipes_count=row['recipes'],
+                ))
+        self.bulk_update(existing.values(), ('amount', 'recipes_count'))
+        self.bulk_create(created)
+        if sign < 0:
+            self.filter(user=user, recipes_count__lte=0).delete()
+
+    @transaction.atomic
+    def refresh(self, user_ids, ingredient_ids=None):
+        """Пересчитывает суммы пользователей по живым данным корзин."""
+        user_ids = list(user_ids)
+        self.lock_users(user_ids)
+        items = self.filter(user_id__in=user_ids)
+        rows = IngredientsRecipe.objects.filter(
+            recipe__shopping_list__user_id__in=user_ids)
+        if ingredient_ids is not None:
+            items = items.filter(ingredient_id__in=ingredient_ids)
+            rows = rows.filter(ingredient_id__in=ingredient_ids)
+        items.delete()
+        self.bulk_create(
+            self.model(
+                user_id=row['recipe__shopping_list__user_id'],
+                ingredient_id=row['ingredient_id'],
+                amount=row['total'],
+                recipes_count=row['recipes'],
+            )
+            for row in self.live_totals(rows)
+        )
+
+    def refresh_recipes(self, recipe_ids, ingredient_ids=None):
+        """Пересчитывает суммы всех, у кого эти рецепты в корзине."""
+        user_ids = set(ShoppingList.objects.filter(
+            recipe_id__in=recipe_ids).values_list('user_id', flat=True))
+        if user_ids:
+            self.refresh(user_ids, ingredient_ids)
+
+    @staticmethod
+    def live_totals(rows):
+        return (
+            rows.values('recipe__shopping_list__user_id', 'ingredient_id')
+            .annotate(
+                total=models.Sum('amount'),
+                recipes=models.Count('recipe_id', distinct=True),
+            )
+            .order_by()
+        )
+
+
+class ShoppingCartItem(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_items'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='shopping_cart_items'
+    )
+    amount = models.FloatField('Количество', default=0)
+    recipes_count = models.IntegerField('Число рецептов', default=0)
+
+    objects = ShoppingCartItemManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_item'
+            )
+        ]
+
+
+class ImageBlob(models.Model):
+    """Файл изображения в хранилище и число ссылающихся рецептов."""
+    name = models.CharField('Путь к файлу', max_length=255, unique=True)
+    references = models.IntegerField('Число ссылок', default=0)
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+        indexes = [
+            models.Index(
+                fields=['references', 'updated'],
+                name='image_blob_gc_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def change(cls, name, delta):
+        if not name:
+            return
+        if not cls.objects.filter(name=name).update(
+                references=models.F('references') + delta,
+                updated=timezone.now()):
+            cls.objects.get_or_create(
+                name=name, defaults={'references': max(delta, 0)}
+            )
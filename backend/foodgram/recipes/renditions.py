@@ -0,0 +1,138 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+MODE = getattr(settings, 'IMAGE_RENDITIONS_MODE', 'thread')
+
+_executor = None
+
+
+def rendition_path(source, name, extension):
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/renditions/{stem}/{name}.{extension}'
+
+
+def delete_renditions(source):
+    directory = os.path.dirname(rendition_path(source, 'full', 'webp'))
+    if not default_storage.exists(directory):
+        return
+    for filename in default_storage.listdir(directory)[1]:
+        default_storage.delete(f'{directory}/{filename}')
+
+
+def encode(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def store(path, content):
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, content)
+
+
+def render(source):
+    """Создаёт уменьшенные копии изображения в WebP и JPEG/PNG."""
+    with default_storage.open(source) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    has_alpha = original.mode in ('RGBA', 'LA', 'P')
+    original = original.convert('RGBA' if has_alpha else 'RGB')
+    renditions = {'source': source}
+    for name, size in RENDITIONS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        if has_alpha:
+            fallback = store(
+                rendition_path(source, name, 'png'),
+                encode(image, 'PNG', optimize=True),
+            )
+        else:
+            fallback = store(
+                rendition_path(source, name, 'jpg'),
+                encode(image, 'JPEG', quality=JPEG_QUALITY, optimize=True,
+                       progressive=True),
+            )
+        webp = store(
+            rendition_path(source, name, 'webp'),
+            encode(image, 'WEBP', quality=WEBP_QUALITY, method=4),
+        )
+        renditions[name] = {'webp': webp, 'fallback': fallback}
+    return renditions
+
+
+def build_renditions(recipe_id):
+    from .models import Recipe
+    close_old_connections()
+    try:
+        recipe = Recipe.objects.filter(pk=recipe_id).first()
+        if recipe is None or not recipe.image:
+            return
+        source = recipe.image.name
+        renditions = render(source)
+        # update() вместо save(): повторный post_save снова запланировал бы
+        # обработку и пересчёт ссылок на изображение. Если изображение уже
+        # заменили, фильтр по нему ничего не обновит.
+        if Recipe.objects.filter(pk=recipe_id, image=source).update(
+                renditions=renditions, updated=timezone.now()):
+            from api.cache import bump_generation
+            bump_generation()
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(recipe):
+    """Запускает обработку изображения согласно IMAGE_RENDITIONS_MODE."""
+    global _executor
+    if MODE == 'sync':
+        transaction.on_commit(lambda: build_renditions(recipe.pk))
+    elif MODE == 'thread':
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix='renditions'
+            )
+        transaction.on_commit(
+            lambda: _executor.submit(build_renditions, recipe.pk)
+        )
+
+
+def needs_renditions(recipe):
+    return bool(recipe.image) and (
+        (recipe.renditions or {}).get('source') != recipe.image.name
+    )
+
+
+def rendition_urls(recipe, request=None):
+    renditions = recipe.renditions or {}
+    if not recipe.image or renditions.get('source') != recipe.image.name:
+        return None
+    build = request.build_absolute_uri if request else (lambda url: url)
+    return {
+        name: {
+            version: build(default_storage.url(path))
+            for version, path in renditions[name].items()
+        }
+        for name in RENDITIONS
+    }
@@ -0,0 +1,122 @@
+from django.db.models import DEFERRED, F
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save, pre_delete)
+from django.dispatch import receiver
+
+from users.models import User, relations_changed
+from .models import (Favorite, ImageBlob, Recipe, ShoppingCartItem,
+                     ShoppingList)
+from .renditions import needs_renditions, schedule
+
+
+@receiver(post_save, sender=Favorite, dispatch_uid='favorite_count_add')
+def favorite_added(sender, instance, created, **kwargs):
+    if created:
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            favorites_count=F('favorites_count') + 1)
+
+
+@receiver(post_delete, sender=Favorite, dispatch_uid='favorite_count_del')
+def favorite_removed(sender, instance, **kwargs):
+    Recipe.objects.filter(
+        pk=instance.recipe_id, favorites_count__gt=0
+    ).update(favorites_count=F('favorites_count') - 1)
+
+
+@receiver(relations_changed, sender=Favorite,
+          dispatch_uid='favorite_count_bulk')
+def favorites_changed(sender, ids, delta, **kwargs):
+    recipes = Recipe.objects.filter(pk__in=ids)
+    if delta < 0:
+        recipes = recipes.filter(favorites_count__gt=0)
+    recipes.update(favorites_count=F('favorites_count') + delta)
+
+
+@receiver(relations_changed, sender=ShoppingList,
+          dispatch_uid='shopping_cart_items_bulk')
+def shopping_list_changed(sender, user, ids, delta, **kwargs):
+    if delta > 0:
+        ShoppingCartItem.objects.add_recipes(user, ids)
+    else:
+        ShoppingCartItem.objects.remove_recipes(user, ids)
+
+
+# Суммы корзин пересчитываются и при изменениях в обход API. Массовые
+# операции API сообщают о себе через relations_changed, правки в админке
+# пересчитываются в ModelAdmin. На строки ShoppingList и IngredientsRecipe
+# обработчиков нет: иначе Django не удаляет их одним запросом, а грузит и
+# сигналит построчно. Удаление рецепта пересчитывает корзины один раз.
+@receiver(pre_delete, sender=Recipe, dispatch_uid='shopping_cart_recipe_pre')
+def remember_cart_users(sender, instance, **kwargs):
+    instance._cart_users = list(
+        instance.shopping_list.values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Recipe, dispatch_uid='shopping_cart_recipe_del')
+def recipe_deleted(sender, instance, **kwargs):
+    user_ids = instance.__dict__.pop('_cart_users', None)
+    if user_ids:
+        ShoppingCartItem.objects.refresh(user_ids)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through,
+          dispatch_uid='shopping_cart_ingredients_m2m')
+def recipe_ingredients_changed(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._cleared_recipes = list(
+            instance.recipes.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        ShoppingCartItem.objects.refresh_recipes([instance.pk], pk_set)
+    else:
+        ShoppingCartItem.objects.refresh_recipes(
+            pk_set or instance.__dict__.pop('_cleared_recipes', []),
+            [instance.pk])
+
+
+@receiver(post_save, sender=Recipe, dispatch_uid='recipe_count_add')
+def recipe_added(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1)
+
+
+@receiver(post_delete, sender=Recipe, dispatch_uid='recipe_count_del')
+def recipe_removed(sender, instance, **kwargs):
+    User.objects.filter(
+        pk=instance.author_id, recipes_count__gt=0
+    ).update(recipes_count=F('recipes_count') - 1)
+
+
+@receiver(post_save, sender=Recipe, dispatch_uid='recipe_renditions')
+def recipe_image_saved(sender, instance, **kwargs):
+    if needs_renditions(instance):
+        schedule(instance)
+
+
+@receiver(post_init, sender=Recipe, dispatch_uid='recipe_image_loaded')
+def remember_image(sender, instance, **kwargs):
+    image = instance.__dict__.get('image', DEFERRED)
+    instance._stored_image = None if image is DEFERRED else str(image or '')
+
+
+@receiver(post_save, sender=Recipe, dispatch_uid='recipe_image_refs')
+def count_image_references(sender, instance, created, **kwargs):
+    if created:
+        old = ''
+    elif instance._stored_image is None:
+        return
+    else:
+        old = instance._stored_image
+    new = instance.image.name or ''
+    if old != new:
+        ImageBlob.change(new, 1)
+        ImageBlob.change(old, -1)
+        instance._stored_image = new
+
+
+@receiver(post_delete, sender=Recipe, dispatch_uid='recipe_image_release')
+def release_image(sender, instance, **kwargs):
+    ImageBlob.change(instance.image.name, -1)
@@ -0,0 +1,256 @@
+import io
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from api.serializers import RecipeShortShowSerializer
+from users.models import User
+from .models import (ImageBlob, Ingredient, IngredientsRecipe, Recipe,
+                     ShoppingCartItem, ShoppingList, Tag)
+from .renditions import RENDITIONS, build_renditions
+from .storage import content_storage
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class ShoppingCartTotalsTest(TestCase):
+    """Суммы корзины не расходятся с корзиной при правках в обход API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com')
+        cls.salt = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        cls.sugar = Ingredient.objects.create(
+            name='Сахар', measurement_unit='г')
+        cls.tag = Tag.objects.create(
+            name='Обед', slug='lunch', color='#00FF00')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {index}', text='текст',
+                cooking_time=10, image='recipes/images/x.png',
+            )
+            for index in range(2)
+        ]
+        for recipe in cls.recipes:
+            IngredientsRecipe.objects.create(
+                recipe=recipe, ingredient=cls.salt, amount=5)
+
+    def totals(self):
+        return dict(ShoppingCartItem.objects.filter(
+            user=self.user).values_list('ingredient_id', 'amount'))
+
+    def test_admin_edits(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        self.client.force_login(admin)
+        for recipe in self.recipes:
+            response = self.client.post(
+                '/admin/recipes/shoppinglist/add/',
+                {'user': self.user.pk, 'recipe': recipe.pk})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(), {self.salt.pk: 10})
+        recipe = self.recipes[0]
+        row = IngredientsRecipe.objects.get(recipe=recipe)
+        response = self.client.post(
+            f'/admin/recipes/recipe/{recipe.pk}/change/', {
+                'name': recipe.name, 'text': recipe.text,
+                'author': self.user.pk, 'cooking_time': 10,
+                'favorites_count': 0, 'tags': [self.tag.pk],
+                'recipe_ingredients-TOTAL_FORMS': 2,
+                'recipe_ingredients-INITIAL_FORMS': 1,
+                'recipe_ingredients-0-id': row.pk,
+                'recipe_ingredients-0-recipe': recipe.pk,
+                'recipe_ingredients-0-ingredient': self.salt.pk,
+                'recipe_ingredients-0-amount': 7,
+                'recipe_ingredients-1-recipe': recipe.pk,
+                'recipe_ingredients-1-ingredient': self.sugar.pk,
+                'recipe_ingredients-1-amount': 3,
+            })
+        self.assertEqual(response.status_code, 302, response.content)
+        self.assertEqual(self.totals(), {self.salt.pk: 12, self.sugar.pk: 3})
+        response = self.client.post('/admin/recipes/shoppinglist/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': ShoppingList.objects.filter(
+                recipe=self.recipes[1]).values_list('pk', flat=True),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(), {self.salt.pk: 7, self.sugar.pk: 3})
+
+    def test_cascade_deletes(self):
+        ShoppingList.objects.add(self.user, [r.pk for r in self.recipes])
+        self.recipes[0].delete()
+        self.assertEqual(self.totals(), {self.salt.pk: 5})
+        self.salt.delete()
+        self.assertEqual(self.totals(), {})
+
+    def test_recipe_delete_refreshes_once(self):
+        for index in range(3):
+            user = User.objects.create_user(
+                username=f'buyer{index}', email=f'buyer{index}@example.com')
+            ShoppingList.objects.add(user, [self.recipes[0].pk])
+        IngredientsRecipe.objects.create(
+            recipe=self.recipes[0], ingredient=self.sugar, amount=3)
+        with mock.patch.object(
+                ShoppingCartItem.objects, 'refresh',
+                wraps=ShoppingCartItem.objects.refresh) as refresh:
+            self.recipes[0].delete()
+        refresh.assert_called_once()
+        self.assertFalse(ShoppingCartItem.objects.exists())
+
+    def test_rebuild(self):
+        ShoppingList.objects.add(self.user, [self.recipes[0].pk])
+        ShoppingCartItem.objects.filter(user=self.user).update(amount=100)
+        with self.assertRaises(Exception):
+            call_command('rebuild_shopping_cart', '--check',
+                         stdout=io.StringIO(), stderr=io.StringIO())
+        call_command('rebuild_shopping_cart', stdout=io.StringIO())
+        self.assertEqual(self.totals(), {self.salt.pk: 5})
+
+
+class LoadIngredientsTest(TestCase):
+
+    def test_counts_only_inserted_rows(self):
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', encoding='utf-8') as file:
+            file.write('Соль,г\nСахар,г\n')
+            file.flush()
+            # Строку «Соль» добавляют в обход предзагруженного набора ключей,
+            # как это сделал бы параллельный процесс.
+            with mock.patch.object(
+                    Ingredient.objects, 'values_list',
+                    return_value=mock.Mock(iterator=lambda: iter([]))):
+                stdout = io.StringIO()
+                call_command('load_ingredients', file.name, stdout=stdout)
+        self.assertIn('Прочитано 2, добавлено 1', stdout.getvalue())
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RenditionsTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 400), (200, 20, 30)).save(buffer, 'PNG')
+        author = User.objects.create_user(
+            username='author', email='author@example.com')
+        with mock.patch('recipes.signals.schedule'):
+            self.recipe = Recipe.objects.create(
+                author=author, name='Рецепт', text='текст', cooking_time=10,
+                image=ContentFile(buffer.getvalue(), 'photo.png'),
+            )
+
+    def test_build_does_not_resave(self):
+        handler = mock.Mock()
+        post_save.connect(handler, sender=Recipe)
+        try:
+            build_renditions(self.recipe.pk)
+        finally:
+            post_save.disconnect(handler, sender=Recipe)
+        handler.assert_not_called()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.renditions['source'],
+                         self.recipe.image.name)
+
+    def test_short_serializer_keeps_original(self):
+        build_renditions(self.recipe.pk)
+        self.recipe.refresh_from_db()
+        data = RecipeShortShowSerializer(self.recipe).data
+        self.assertEqual(data['image'], self.recipe.image.url)
+        self.assertEqual(set(data['renditions']), set(RENDITIONS))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class GarbageCollectionTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com')
+        self.name = content_storage.save(
+            'recipes/images/photo.png', ContentFile(b'png'))
+        ImageBlob.objects.create(name=self.name)
+        ImageBlob.objects.filter(name=self.name).update(
+            updated=timezone.now() - timedelta(days=2))
+
+    def test_unreferenced_file_is_deleted(self):
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertFalse(content_storage.exists(self.name))
+        self.assertFalse(ImageBlob.objects.filter(name=self.name).exists())
+
+    def test_file_referenced_during_delete_is_restored(self):
+        delete = content_storage.delete
+
+        def delete_and_reuse(name):
+            delete(name)
+            with mock.patch('recipes.signals.schedule'):
+                Recipe.objects.create(
+                    author=self.author, name='Рецепт', text='текст',
+                    cooking_time=10, image=name,
+                )
+
+        with mock.patch.object(content_storage, 'delete', delete_and_reuse):
+            call_command('gc_media', stdout=io.StringIO())
+        self.assertTrue(content_storage.exists(self.name))
+        self.assertEqual(
+            ImageBlob.objects.get(name=self.name).references, 1)
+
+    def test_change_touches_updated(self):
+        ImageBlob.change(self.name, 1)
+        self.assertGreater(
+            ImageBlob.objects.get(name=self.name).updated,
+            timezone.now() - timedelta(minutes=1))
+
+
+class SeedDataTest(TestCase):
+    """Набор с тем же seed не зависит от того, что уже лежит в базе."""
+
+    options = {
+        'users': 4, 'recipes': 10, 'ingredients': 12, 'tags': 3,
+        'ingredients_per_recipe': 3, 'follows_per_user': 2,
+        'favorites_per_user': 3, 'cart_per_user': 2,
+    }
+
+    def seed(self, *args):
+        call_command('seed_data', *args, stdout=io.StringIO(),
+                     **self.options)
+        return {
+            (recipe.author.username, recipe.name, recipe.cooking_time,
+             tuple(sorted(
+                 (row.ingredient.name, row.amount)
+                 for row in recipe.recipe_ingredients.all())),
+             tuple(sorted(tag.slug for tag in recipe.tags.all())),
+             tuple(sorted(
+                 favorite.user.username for favorite in recipe.favorites.all()
+             )))
+            for recipe in Recipe.objects.select_related('author')
+        }
+
+    def test_reproducible(self):
+        expected = self.seed()
+        self.assertEqual(self.seed(), expected)
+        author = User.objects.create_user(
+            username='chef', email='chef@example.com')
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        Tag.objects.create(name='Завтрак', slug='breakfast', color='#FF0000')
+        Recipe.objects.create(
+            author=author, name='Чужой', text='текст', cooking_time=10,
+            image='recipes/images/x.png',
+        )
+        actual = self.seed('--clear')
+        self.assertEqual(
+            {row for row in actual if row[0] != 'chef'}, expected)
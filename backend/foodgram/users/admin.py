@@ -6,7 +6,14 @@ from .models import User, Follow
 
 class CustomUserAdmin(UserAdmin):
     model = User
-    list_display = ('username', 'first_name', 'last_name', 'email')
+    list_display = (
+        'username',
+        'first_name',
+        'last_name',
+        'email',
+        'recipes_count',
+        'followers_count',
+    )
     list_filter = ('username', 'email')
     search_fields = ('username', 'email')
 
@@ -1,11 +1,23 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models
+from django.dispatch import Signal
 from rest_framework.exceptions import ValidationError
 
+# Отправляется UserRelationManager вместо post_save/post_delete с
+# аргументами user, ids (id объектов, связь с которыми изменилась) и
+# delta (+1 или -1). На него подписаны счётчики подписчиков и избранного,
+# суммы корзины и кеш ответов API.
+relations_changed = Signal()
+
 
 class User(AbstractUser):
 
     password = models.CharField(max_length=150)
+    recipes_count = models.PositiveIntegerField('Число рецептов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0
+    )
 
     class Meta:
         ordering = ['id']
@@ -16,20 +28,99 @@ class User(AbstractUser):
         return self.username
 
 
+class UserRelationManager(models.Manager):
+    """Добавляет и удаляет связи пользователя с объектами одним запросом.
+
+    add() вставляет строки через ON CONFLICT DO NOTHING, remove() удаляет
+    их одним DELETE; оба возвращают id объектов, связь с которыми
+    действительно изменилась, и вместо post_save/post_delete отправляют
+    relations_changed.
+
+    SQL написан вручную намеренно: bulk_create(ignore_conflicts=True) не
+    сообщает, какие строки вставлены, а удаление через QuerySet.delete()
+    сначала выбирает строки и шлёт сигнал на каждую. RETURNING даёт точный
+    список изменений за один запрос и без гонок между параллельными
+    запросами. Поэтому обработчики post_save/post_delete моделей связей на
+    эти изменения не срабатывают: всё, что должно на них реагировать,
+    подписывается на relations_changed. RETURNING требует PostgreSQL или
+    SQLite 3.35+.
+    """
+
+    def __init__(self, target=None, exclude_user=False):
+        super().__init__()
+        self.target = target
+        self.exclude_user = exclude_user
+
+    def add(self, user, ids):
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return []
+        field = self.model._meta.get_field(self.target)
+        target = field.related_model._meta
+        quote = connections[self.db].ops.quote_name
+        pk = quote(target.pk.column)
+        placeholders = ', '.join(['%s'] * len(ids))
+        params = [user.pk, *ids]
+        sql = (
+            f'INSERT INTO {quote(self.model._meta.db_table)} '
+            f'({quote(self.user_column)}, {quote(field.column)}) '
+            f'SELECT %s, {pk} FROM {quote(target.db_table)} '
+            f'WHERE {pk} IN ({placeholders})'
+        )
+        if self.exclude_user:
+            sql += f' AND {pk} <> %s'
+            params.append(user.pk)
+        sql += f' ON CONFLICT DO NOTHING RETURNING {quote(field.column)}'
+        return self.execute(user, sql, params, 1)
+
+    def remove(self, user, ids):
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return []
+        column = self.model._meta.get_field(self.target).column
+        quote = connections[self.db].ops.quote_name
+        placeholders = ', '.join(['%s'] * len(ids))
+        sql = (
+            f'DELETE FROM {quote(self.model._meta.db_table)} '
+            f'WHERE {quote(self.user_column)} = %s '
+            f'AND {quote(column)} IN ({placeholders}) '
+            f'RETURNING {quote(column)}'
+        )
+        return self.execute(user, sql, [user.pk, *ids], -1)
+
+    @property
+    def user_column(self):
+        return self.model._meta.get_field('user').column
+
+    def execute(self, user, sql, params, delta):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            changed = sorted(row[0] for row in cursor.fetchall())
+        if changed:
+            relations_changed.send(
+                sender=self.model, user=user, ids=changed, delta=delta
+            )
+        return changed
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name="Пользователь",
         related_name='follower',
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name="Автор",
         related_name='following',
+        db_index=False,
     )
 
+    objects = UserRelationManager('author', exclude_user=True)
+
     def save(self, **kwargs):
         if self.user == self.author:
             raise ValidationError("Невозможно подписаться на себя")
@@ -49,3 +140,9 @@ class Follow(models.Model):
                 name='no_self_follow'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'),
+                name='follow_author_user_idx'
+            ),
+        )
@@ -0,0 +1,27 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Follow, User, relations_changed
+
+
+@receiver(post_save, sender=Follow, dispatch_uid='follow_count_add')
+def follow_added(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            followers_count=F('followers_count') + 1)
+
+
+@receiver(post_delete, sender=Follow, dispatch_uid='follow_count_del')
+def follow_removed(sender, instance, **kwargs):
+    User.objects.filter(
+        pk=instance.author_id, followers_count__gt=0
+    ).update(followers_count=F('followers_count') - 1)
+
+
+@receiver(relations_changed, sender=Follow, dispatch_uid='follow_count_bulk')
+def follows_changed(sender, ids, delta, **kwargs):
+    authors = User.objects.filter(pk__in=ids)
+    if delta < 0:
+        authors = authors.filter(followers_count__gt=0)
+    authors.update(followers_count=F('followers_count') + delta)